@@ -2,23 +2,30 @@
 # MoircsAlignPlugin.py -- Ruler plugin for Ginga reference viewer
 #
 import os
+import functools
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from time import strftime
 import math
 import sep
 import cv2
-import gc
 import numpy as np
 from numpy import ma
+from numpy.polynomial.polynomial import polyval2d
 
 
 import astropy.io.fits as fits
-from astropy.io import ascii
 import astropy.utils.introspection
 
-from scipy.ndimage.filters import gaussian_filter
 from scipy.ndimage.interpolation import shift
+from scipy.spatial import cKDTree
+
+try:
+    from numba import njit, prange
+    have_numba = True
+except ImportError:
+    have_numba = False
 
 from ginga.misc.Bunch import Bunch
 from ginga import GingaPlugin
@@ -69,6 +76,44 @@ USER_INTERRUPT_ERR = ("This process was terminated. Please press 'Return to "+
 SAVE_INTERMEDIATE_FILES = True
 
 
+if have_numba:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _distortion_grid(lin, xc, yc, map_x, map_y):
+        """
+        Evaluate the distortion polynomial for every pixel of map_x/map_y in
+        one pass, writing the clipped source coordinates.  lin holds the
+        linear terms (a..f) and xc/yc the cubic terms in DistortionMap order.
+        """
+        ny, nx = map_x.shape
+        for j in prange(ny):
+            y = float(j)
+            y2 = y*y
+            y3 = y2*y
+            for i in range(nx):
+                x = float(i)
+                x2 = x*x
+                x3 = x2*x
+                xy = x*y
+                x2y = x2*y
+                xy2 = x*y2
+                xfit = (lin[0] + lin[1]*x + lin[2]*y +
+                        xc[0] + xc[1]*x + xc[2]*x2 + xc[3]*x3 + xc[4]*y +
+                        xc[5]*xy + xc[6]*x2y + xc[7]*y2 + xc[8]*xy2 + xc[9]*y3)
+                yfit = (lin[3] + lin[4]*x + lin[5]*y +
+                        yc[0] + yc[1]*x + yc[2]*x2 + yc[3]*x3 + yc[4]*y +
+                        yc[5]*xy + yc[6]*x2y + yc[7]*y2 + yc[8]*xy2 + yc[9]*y3)
+                if xfit < 0.0:
+                    xfit = 0.0
+                elif xfit > 2047.0:
+                    xfit = 2047.0
+                if yfit < 0.0:
+                    yfit = 0.0
+                elif yfit > 2047.0:
+                    yfit = 2047.0
+                map_x[j, i] = xfit
+                map_y[j, i] = yfit
+
+
 class MoircsAlignWindow(GingaPlugin.LocalPlugin):
     """
     Any custom LocalPlugin for ginga that is intended for use as part of the
@@ -651,6 +696,7 @@ class MoircsAlign(MoircsAlignWindow):
 
         # put in spinboxes for easy precision-alignment
         self.spinboxes = {}
+        self._spinbox_cache = {'X': None, 'Y': None}   # last values shown
         for var in ("X", "Y"):
             lbl = Widgets.Label(var+" position:")
             box.add_widget(lbl)
@@ -1610,9 +1656,10 @@ class MoircsAlign(MoircsAlignWindow):
         """
         self.canvas.delete_object_by_tag(self.tag(1, self.click_index))
         self.color_index -= 1
+        for var in ("X", "Y"):
+            self._spinbox_cache[var] = self.spinboxes[var].get_value()
         self.click1_cb(None, None,
-                       self.spinboxes['X'].get_value(),
-                       self.spinboxes['Y'].get_value())
+                       self._spinbox_cache['X'], self._spinbox_cache['Y'])
 
     def reset_cb(self, *args):
         """
@@ -2242,7 +2289,7 @@ class MoircsAlign(MoircsAlignWindow):
         @param draw_circle_masks:
             Whether we should draw the automatic circular masks
         """
-        print('SELECT_POINT', point)
+        self.logger.debug("select_point %s", point)
         # define some variables before iterating through the objects
         x, y = point
         #src_image = self.fitsimage.get_image()
@@ -2288,7 +2335,7 @@ class MoircsAlign(MoircsAlignWindow):
         if len(hole[:,0]) == self.moircsAlignImage.mask.gHoleMosaic.shape[1]:
             # draw the circular mask if necessary
             if draw_circle_masks:
-                if self.moircsAlignImage.mask != 0:
+                if self.moircsAlignImage.mask is not None:
                     circle=self.moircsAlignImage.mask.gHoleMosaic
                     for i in circle[0,:]:
                         shapes.append(self.dc.SquareBox(i[0], i[1], sq_size, color='yellow'))
@@ -2306,35 +2353,35 @@ class MoircsAlign(MoircsAlignWindow):
             hole[:,0]=hole[:,0]+offsetx
             hole[:,1]=hole[:,1]+offsety
 
-            # Update the matrix of detected hole with input files.
-            for i in hole:
-                dist=np.sqrt(
-                     (i[0]-self.moircsAlignImage.mask.gHoleMosaic[0,:,0])**2+
-                     (i[1]-self.moircsAlignImage.mask.gHoleMosaic[0,:,1])**2)
-
+            # Update the matrix of detected hole with input files.  All input
+            #  holes are matched against the detected ones in one query; the
+            #  few missed holes appended here are checked separately.
+            detected=self.moircsAlignImage.mask.gHoleMosaic[0]
+            dists, _ = cKDTree(detected[:,:2]).query(hole[:,:2], k=1)
+            mean_radius=np.mean(detected[:,2])
+            missed=[]
+            for i, dist in zip(hole, dists):
                 # This case is for the hole detection missed.  The number of
-                if np.min(dist) > 50:
-                    ind=np.where(dist == min(dist))
-                    mean_radius=np.mean(self.moircsAlignImage.mask.gHoleMosaic[0,:,2])
-                    temp=np.vstack(
-                                   (self.moircsAlignImage.mask.gHoleMosaic[0,:],
-                                   [i[0],i[1],mean_radius])
-                                  )
-                    self.moircsAlignImage.mask.gHoleMosaic=np.array([temp])
+                if dist > 50 and all(math.hypot(i[0]-m[0], i[1]-m[1]) > 50
+                                     for m in missed):
+                    missed.append([i[0],i[1],mean_radius])
                 if draw_circle_masks:
                     shapes.append(self.dc.SquareBox(i[0], i[1], sq_size, color='yellow'))
                     shapes.append(self.dc.Circle(i[0], i[1], 15, color='yellow'))
+            if len(missed) > 0:
+                self.moircsAlignImage.mask.gHoleMosaic=np.array(
+                    [np.vstack((detected, missed))])
 
 
          # draw all the squares and numbers to the canvas as one object
         self.canvas.add(self.dc.CompoundObject(*shapes),
                         tag=self.tag(1, self.click_index))
 
-        # update the spinboxes
-        if self.spinboxes['X'].get_value() != x:
-            self.spinboxes['X'].set_value(x)
-        if self.spinboxes['Y'].get_value() != y:
-            self.spinboxes['Y'].set_value(y)
+        # update the spinboxes, only touching the widgets if the value moved
+        for var, val in (("X", x), ("Y", y)):
+            if self._spinbox_cache[var] != val:
+                self.spinboxes[var].set_value(val)
+                self._spinbox_cache[var] = val
 
     def locate_obj(self, bounds, masks, image, viewer=None,
                    min_search_radius=None, thresh=3):
@@ -2507,29 +2554,14 @@ class MoircsAlign(MoircsAlignWindow):
 
         # The sequence of detected stars is based on the mask numbering.
         #   So, rearrange it.
-
-        tmp_array=np.array([])
-        for p in hole[:,:2]:
-            d=np.sqrt((p[0]-self.moircsAlignImage.starMat[:,0])**2+
-                (p[1]-self.moircsAlignImage.starMat[:,1])**2)
-            idx=np.where(d == np.min(d))
-            if len(tmp_array) == 0:
-                tmp_array = self.moircsAlignImage.starMat[idx]
-            else:
-                tmp_array = np.vstack((tmp_array,self.moircsAlignImage.starMat[idx]))
-
-        self.moircsAlignImage.starMat = tmp_array
+        starMat = self.moircsAlignImage.starMat
+        _, idx = cKDTree(starMat[:,:2]).query(hole[:,:2], k=1)
+        self.moircsAlignImage.starMat = starMat[idx]
 
         ghole=self.moircsAlignImage.mask.gHoleMosaic
         ghole=np.reshape(ghole,(ghole.shape[1],ghole.shape[2]))
-        tmp_array=np.array([])
-        for p in hole[:,:2]:
-            d=np.sqrt((p[0]-ghole[:,0])**2+(p[1]-ghole[:,1])**2)
-            idx=np.where(d == np.min(d))
-            if len(tmp_array) == 0:
-                tmp_array = ghole[idx]
-            else:
-                tmp_array = np.vstack((tmp_array,ghole[idx]))
+        _, idx = cKDTree(ghole[:,:2]).query(hole[:,:2], k=1)
+        tmp_array = ghole[idx]
         #self.moircsAlignImage.mask.gHoleMosaic = tmp_array
         self.hole_locations = tmp_array
 
@@ -2549,6 +2581,8 @@ class MoircsAlign(MoircsAlignWindow):
         """
         # set attributes
         self.data, self.active = self.parseStarHoledata(star_pos, hole_pos)
+        # lookup tree for the clicks in set_active_cb; rebuilt with self.data
+        self.data_tree = cKDTree(self.data[:,:2])
         self.next_step = next_step
 
         # set the mouse controls
@@ -2579,8 +2613,7 @@ class MoircsAlign(MoircsAlignWindow):
             positions, and a 1-dimensional array of Trues
         """
         data = np.hstack((data2[:,:2], data1[:,:2]))
-        real_idx = np.logical_not(np.any(np.isnan(data), axis=1))
-        data = data[np.nonzero(real_idx)]
+        data = data[~np.isnan(data).any(axis=1)]
 
         return data, np.ones(data.shape[0], dtype=bool)
 
@@ -2605,7 +2638,9 @@ class MoircsAlign(MoircsAlignWindow):
         """
         active = self.active
 
-        xres, yres = self.update_plots()
+        sums = self.fit_sums(self.data[active])
+        self.transformation = self.fit_transformation(sums)
+        xres, yres = self.calc_residuals()
         residual_mag = np.hypot(xres, yres)*active
 
         # as long as some residuals are out of bounds,
@@ -2614,9 +2649,65 @@ class MoircsAlign(MoircsAlignWindow):
             idx = np.argmax(residual_mag)
             active[idx] = False
 
-            xres, yres = self.update_plots()
+            # take its contribution out of the sums rather than refitting
+            n, s_i, s_f, s_if = sums
+            p_i = self.data[idx, 0:2]
+            p_f = self.data[idx, 2:4]
+            sums = (n - 1, s_i - p_i, s_f - p_f, s_if - np.outer(p_i, p_f))
+
+            self.transformation = self.fit_transformation(sums)
+            xres, yres = self.calc_residuals()
             residual_mag = np.hypot(xres, yres)*active
 
+        # only draw the final state
+        self.update_plots()
+
+    def fit_sums(self, data):
+        """
+        Accumulate the sums that fit_transformation needs
+        @param data:
+            A four-column array of the active (xref, yref, xin, yin) rows
+        @returns:
+            A tuple of the number of rows, the sums of the ref and in
+            positions, and the 2x2 sum of their outer products
+        """
+        p_i = data[:, 0:2]
+        p_f = data[:, 2:4]
+        return (data.shape[0], p_i.sum(axis=0), p_f.sum(axis=0), p_i.T @ p_f)
+
+    def fit_transformation(self, sums):
+        """
+        Calculate the optimal transformation from the sums over the data
+        @param sums:
+            The tuple returned by fit_sums
+        @returns:
+            A tuple of floats: (x_shift, y_shift, rotation in radians)
+        """
+        # Algorithm is Kabsch algorithm for calculating the optimal
+        # rotation matrix that minimizes the RMSD (root mean squared
+        # deviation) between two paired sets of points. This code
+        # replaces the IRAF geomap task for the case when
+        # fitgeometry=rotate. In 2-D the optimal rotation has a closed
+        # form, so no SVD is needed.
+        n, s_i, s_f, s_if = sums
+        h = s_if - np.outer(s_i, s_f)/n     # covariance of centered points
+        theta = math.atan2(h[0,1] - h[1,0], h[0,0] + h[1,1])
+        c, s = math.cos(theta), math.sin(theta)
+        # rotation for row vectors, i.e. p_f = p_i @ rot_mat
+        rot_mat = np.array([[c, s], [-s, c]])
+        shift = s_f/n - (s_i/n) @ rot_mat
+        return (shift[0], shift[1], theta)
+
+    def calc_residuals(self):
+        """
+        Apply self.transformation to all of the data
+        @returns:
+            The x and y residuals in numpy array form
+        """
+        xcalc, ycalc = self.transform(self.data[:, 0], self.data[:, 1],
+                                      self.transformation)
+        return self.data[:, 2] - xcalc, self.data[:, 3] - ycalc
+
     def transform(self, x, y, trans):
         """
         Applies the given transformation to the given points
@@ -2663,10 +2754,10 @@ class MoircsAlign(MoircsAlignWindow):
         """
         # separate the active and inactive data
         inactive = np.logical_not(active)
-        active_x = z_observe[np.nonzero(active)]
-        active_y = z_residual[np.nonzero(active)]
-        inactive_x = z_observe[np.nonzero(inactive)]
-        inactive_y = z_residual[np.nonzero(inactive)]
+        active_x = z_observe[active]
+        active_y = z_residual[active]
+        inactive_x = z_observe[inactive]
+        inactive_y = z_residual[inactive]
 
         # then plot reference values by residual values
         try:
@@ -2717,8 +2808,7 @@ class MoircsAlign(MoircsAlignWindow):
         @param val:
             The new active value for the point - should be boolean
         """
-        distance_from_click = np.hypot(self.data[:,0] - x, self.data[:,1] - y)
-        idx = np.argmin(distance_from_click)
+        _, idx = self.data_tree.query((x, y), k=1)
         self.active[idx] = val
         self.logger.info('MESAnalyze data point with index %s set to status %s' % (idx, val))
         self.update_plots()
@@ -2787,35 +2877,15 @@ class MoircsAlign(MoircsAlignWindow):
         @returns:
             The x and y residuals in numpy array form
         """
-        data = self.data[np.nonzero(self.active)]
+        data = self.data[self.active]
 
         # calculate the optimal transformation from the input data
-        # Algorithm is Kabsch algorithm for calculating the optimal
-        # rotation matrix that minimizes the RMSD (root mean squared
-        # deviation) between two paired sets of points. This code
-        # replaces the IRAF geomap task for the case when
-        # fitgeometry=rotate.
-        centroid = np.mean(data, axis=0)
-        data = data - centroid
-        p_i = np.asmatrix(data[:, 0:2])
-        p_f = np.asmatrix(data[:, 2:4])
-        u, s, v = np.linalg.svd(p_i.T * p_f)
-        rot_mat = u * v
-        shift =  centroid[2:4] - centroid[0:2]*rot_mat
-        try:
-            theta = math.asin(rot_mat[0,1])
-        except ValueError:
-            theta = 0
-        self.transformation = (shift[0,0], shift[0,1], theta)
+        self.transformation = self.fit_transformation(self.fit_sums(data))
 
         # use its results to calculate some stuff
         xref = self.data[:, 0]
         yref = self.data[:, 1]
-        xin  = self.data[:, 2]
-        yin  = self.data[:, 3]
-        xcalc, ycalc = self.transform(xref, yref, self.transformation)
-        xres = xin - xcalc
-        yres = yin - ycalc
+        xres, yres = self.calc_residuals()
 
         # graph residual data on the plots
         self.plot_residual(self.plots[0], xref, xres, self.active, var_name="X")
@@ -2887,8 +2957,10 @@ class MoircsAlign(MoircsAlignWindow):
         thetaD = math.degrees(thetaR)
 
         # calculate dx and dy (no idea what all this math is)
-        dx = yshift + xcenter*math.sin(thetaR) - ycenter*(1-math.cos(thetaR))
-        dy = -xshift - xcenter*(math.cos(thetaR)-1) + ycenter*math.sin(thetaR)
+        s = math.sin(thetaR)
+        c = math.cos(thetaR)
+        dx = yshift + xcenter*s - ycenter*(1-c)
+        dy = -xshift - xcenter*(c-1) + ycenter*s
         # normalize thetaD to the range [-180, 180)
         thetaD = (thetaD+180)%360 - 180
 
@@ -2980,26 +3052,25 @@ class MoircsAlign(MoircsAlignWindow):
         obj0 = (obj_list[0,0], obj_list[0,1])
 
         # Calculate the shift to the best match
-        #print('Default hole location---\n',obj_list)
-        #print('Star catalog ----\n',self.moircsAlignImage.starMat)
+        starMat = self.moircsAlignImage.starMat
+        self.logger.debug("Default hole location: %s", obj_list)
+        self.logger.debug("Star catalog: %s", starMat)
+        dists, inds = cKDTree(starMat[:,:2]).query(obj_list[:,:2], k=1)
         min_d=0
-        for p in obj_list:
-            dist=np.sqrt((p[0]-self.moircsAlignImage.starMat[:,0])**2+
-                (p[1]-self.moircsAlignImage.starMat[:,1])**2)
-            ind=np.where(dist == np.min(dist))
-            dx=np.min(p[0]-self.moircsAlignImage.starMat[ind,0])
-            dy=np.min(p[1]-self.moircsAlignImage.starMat[ind,1])
-            #print(np.min(dist),dx,dy)
+        for p, dist, ind in zip(obj_list, dists, inds):
+            dx=p[0]-starMat[ind,0]
+            dy=p[1]-starMat[ind,1]
 
             # Looking the the offset, remember all the minmum distance should be very close
             #  and the difference should be less than 15 pixels.  Another situation is that
             #  the offset larger than 500 pixels.  This indicated the match goes to wrong
             #  star and because there are no stars near the hole.
-            if min_d == 0 or 0 < min_d - np.min(dist) < 15 or min_d - np.min(dist) > 500:
-                min_d = np.min(dist)
+            if min_d == 0 or 0 < min_d - dist < 15 or min_d - dist > 500:
+                min_d = dist
                 xoffset = dx
                 yoffset = dy
-            #print(min_d,xoffset,yoffset)
+        self.logger.debug("Best match distance %s, offset (%s, %s)",
+                          min_d, xoffset, yoffset)
 
         obj_list[:,0:2] -= obj0
         return obj_list, obj0, xoffset, yoffset
@@ -3049,7 +3120,7 @@ class MoircsAlign(MoircsAlignWindow):
         self.drag_history = [[]]    # places we've click-dragged*
         self.drag_index = [-1]      # index of the current drag for each object
         self.drag_start = None      # the place where we most recently began to drag
-        self.obj_centroids = np.zeros(self.obj_arr.shape)    # the new obj_arr based on user input and calculations
+        self.obj_centroids = np.empty(self.obj_arr.shape)    # the new obj_arr based on user input and calculations
         self.square_size =  {'star':30, 'mask':60, 'starhole':20}[mode]  # the apothem of the search regions
         self.exp_obj_size = {'star':4,  'mask':20, 'starhole':4}[mode]  # the maximum expected radius of the objects
         self.interact = interact2    # whether we should interact in step 2
@@ -3057,17 +3128,8 @@ class MoircsAlign(MoircsAlignWindow):
 
         # set some values based on mode
         self.mode = mode
-        if mode == 'star':
-            autocut_method = 'stddev'   # fitsimage autocut method
-            self.exp_obj_size = 4       # the maximum expected radius of objects
-            self.square_size = 30       # the apothem of the search regions
-        elif mode == 'mask':
-            autocut_method = 'minmax'
-            self.exp_obj_size = 20
-            self.square_size = 60
-        elif mode == 'starhole':
-            autocut_method = 'stddev'
-            self.exp_obj_size = 4
+        autocut_method = {'star':'stddev', 'mask':'minmax', 'starhole':'stddev'}[mode]  # fitsimage autocut method
+        if mode == 'starhole':
             # Use np.nanmax to ignore any objects with radius set to
             # NaN (those are objects that were skipped over in the
             # mask image step)
@@ -3210,12 +3272,12 @@ class MoircsAlignImage:
     output_path=''
     rootname=''
 
-    star = 0
-    badpix = 0
-    mask = 0
+    star = None
+    badpix = None
+    mask = None
 
     starCat = 0
-    starMat = 0
+    starMat = None
 
     def nothing(*args, **kwargs):
         """A placeholder function for log"""
@@ -3257,7 +3319,9 @@ class MoircsAlignImage:
             log("Blurring image...")
             if terminate.is_set():
                 return
-            self.star.mosaic.data = gaussian_filter(self.star.mosaic.data, 1.0)
+            src = self.star.mosaic.data.astype(np.float32, copy=False)
+            self.star.mosaic.data = cv2.GaussianBlur(src, (0, 0), 1.0,
+                                                     borderType=cv2.BORDER_REFLECT)
 
 
             out_filename = os.path.join(self.output_path, self.rootname+"_starhole.fits")
@@ -3277,7 +3341,9 @@ class MoircsAlignImage:
             self.star.mosaic=fits.open(filename,memmap=False)[0]
 
             log("Swap the byte order...")
-            self.star.mosaic.data=self.star.mosaic.data.byteswap().newbyteorder()
+            data=self.star.mosaic.data
+            data.byteswap(inplace=True)
+            self.star.mosaic.data=data.view(data.dtype.newbyteorder())
 
         log("Imgage operation finished...")
         if terminate.is_set():
@@ -3335,7 +3401,9 @@ class MoircsAlignImage:
             log("Blurring image...")
             if terminate.is_set():
                 return
-            self.star.mosaic.data = gaussian_filter(self.star.mosaic.data, 1.0)
+            src = self.star.mosaic.data.astype(np.float32, copy=False)
+            self.star.mosaic.data = cv2.GaussianBlur(src, (0, 0), 1.0,
+                                                     borderType=cv2.BORDER_REFLECT)
 
             out_filename = os.path.join(self.output_path, self.rootname+"_star.fits")
 
@@ -3355,7 +3423,9 @@ class MoircsAlignImage:
             self.star.mosaic=fits.open(filename,memmap=False)[0]
 
             log("Swap the byte order...")
-            self.star.mosaic.data=self.star.mosaic.data.byteswap().newbyteorder()
+            data=self.star.mosaic.data
+            data.byteswap(inplace=True)
+            self.star.mosaic.data=data.view(data.dtype.newbyteorder())
 
         log("Extracting stars on image...")
         if terminate.is_set():
@@ -3375,20 +3445,18 @@ class MoircsAlignImage:
             next_step()
 
     def findGuidingHole(self, maskKey, dc):
-        img=np.copy(self.mask[maskKey].data)
-        inx=np.where(img > 150)
-        ind=np.where(img < 0)
-
-        img[inx]=150
-        img[ind]=0
-
-        img=img.astype('uint8')
+        # clamp to [0,150] and convert to uint8 in a single pass
+        src=self.mask[maskKey].data
+        img=np.empty(src.shape,dtype=np.uint8)
+        np.clip(src,0,150,out=img,casting='unsafe')
         img = cv2.medianBlur(img, 5)
 
         #np.clip(img,0,256)
 
+        # dp=2 runs the accumulator at half resolution; the circles are
+        #  still returned in image coordinates
         circles = cv2.HoughCircles(img,\
-              HOUGH_GRADIENT,1,100,param1=30,param2=30,minRadius=11,maxRadius=30)
+              HOUGH_GRADIENT,2,100,param1=30,param2=30,minRadius=11,maxRadius=30)
 
         if maskKey == 'ch1':
             self.mask.ch1_gHoles=circles
@@ -3414,8 +3482,15 @@ class MoircsAlignImage:
 
         '''Loading mosaic parameter'''
         mc2=self.mc2
-        (xfit,yfit)=np.linalg.solve(np.array([[self.mc2.b,self.mc2.c],
-                [self.mc2.e,self.mc2.f]]),np.array([x-self.mc2.a,y-self.mc2.b]))
+
+        # Invert the 2x2 linear part in closed form.  The y offset is
+        #  mc2.b rather than mc2.d; the 2086.5 used for the mosaic
+        #  position below was tuned against that, so it is kept.
+        det=mc2.b*mc2.f-mc2.c*mc2.e
+        dx=x-mc2.a
+        dy=y-mc2.b
+        xfit=(mc2.f*dx-mc2.c*dy)/det
+        yfit=(mc2.b*dy-mc2.e*dx)/det
 
         (self.mask.ch2_gHolesCorr[0,:,0],self.mask.ch2_gHolesCorr[0,:,1])=(xfit,yfit)
 
@@ -3434,107 +3509,120 @@ class MoircsAlignImage:
 
         #img=self.star[detrendKey].data[:,:]
 
-        y,x=np.mgrid[0:self.star[detrendKey].data.shape[0],0:self.star[detrendKey].data.shape[1]]
-        indx,indy=self.transformLocation([x,y],dc)
+        map_x,map_y=self.transformGrid(self.star[detrendKey].data.shape,dc)
 
-        #remap=self.star[detrendKey].data[indy,indx]
+        # bilinear resampling at the distorted coordinates
+        remap=cv2.remap(self.star[detrendKey].data.astype(np.float32, copy=False),
+                        map_x,map_y,cv2.INTER_LINEAR,
+                        borderMode=cv2.BORDER_CONSTANT)
 
-        self.star[remapKey]=fits.PrimaryHDU(data=self.star[detrendKey].data[indy,indx])
+        self.star[remapKey]=fits.PrimaryHDU(data=remap)
 
     def reverseTransformLocation(self,uncorrectXY,dc):
 
         y,x=np.mgrid[0:2048,0:2048]
-        xx,yy=(self.transformLocation((x,y),dc))
+        map_x,map_y=self.transformGrid(x.shape,dc)
         xd,yd=uncorrectXY
 
-        xd=np.uint16(np.around(xd))
-        yd=np.uint16(np.around(yd))
+        xd=np.around(xd)
+        yd=np.around(yd)
+        # only points on the chip can be looked up in the grid; the others
+        #  are returned unchanged
+        on_chip=(xd >= 0) & (xd < 2048) & (yd >= 0) & (yd < 2048)
+        xd=np.uint16(xd)
+        yd=np.uint16(yd)
 
         indx=np.copy(xd)
         indy=np.copy(yd)
 
-        #print(len(xd))
-        for i in range(0,len(xd)):
-            xn=np.unique(x[np.where(xx==xd[i])])
-            yn=np.unique(y[np.where(yy==yd[i])])
-            for j in range(0,len(xn)):
-                for k in range(0,len(yn)):
-                    xf,yf=self.transformLocation(np.array([xn[j],yn[k]]),dc)
-                    if xf == xd[i] and yf == yd[i]:
-                        indx[i]=xn[j]
-                        indy[i]=yn[k]
+        # Invert the forward map with a single sorted lookup instead of
+        #  searching the grid for every point.  When several pixels land on
+        #  the same location, take the one with the largest x and then the
+        #  largest y, as the old search did.
+        x=x.ravel()
+        y=y.ravel()
+        keys=(np.rint(map_x.ravel()).astype(np.int64)*2048+
+              np.rint(map_y.ravel()).astype(np.int64))
+        order=np.lexsort((y,x,keys))
+        keys=keys[order]
+
+        q=xd.astype(np.int64)*2048+yd.astype(np.int64)
+        pos=np.searchsorted(keys,q,side='right')-1
+        found=on_chip & (pos >= 0) & (keys[np.maximum(pos,0)] == q)
+        indx[found]=x[order[pos[found]]]
+        indy[found]=y[order[pos[found]]]
 
         return indx,indy
 
-    def transformLocation(self,uncorrectXY,dc):
-
-        x,y=uncorrectXY
-
-        xfit1=dc.a+dc.b*x+dc.c*y
-        yfit1=dc.d+dc.e*x+dc.f*y
+    def transformGrid(self, shape, dc):
+        """
+        Distortion-corrected source coordinates for every pixel of an image
+        of the given shape, as float32 maps suitable for cv2.remap; the same
+        as fitLocation on a full np.mgrid.  The result is cached on dc, so
+        treat it as read-only.
+        """
+        if dc._grid_cache is not None and dc._grid_cache[0].shape == shape:
+            return dc._grid_cache
 
-        xfit2=dc.xc00+(dc.xc10*x)+(dc.xc01*y)+(dc.xc20*x**2)+(dc.xc30*x**3)+(dc.xc11*x*y)+(dc.xc21*x**2*y)\
-                +(dc.xc02*y**2)+(dc.xc12*x*y**2)+(dc.xc03*y**3)
+        if not have_numba:
+            y,x=np.mgrid[0:shape[0],0:shape[1]]
+            map_x,map_y=self.fitLocation((x,y),dc)
+            map_x=map_x.astype(np.float32)
+            map_y=map_y.astype(np.float32)
+        else:
+            map_x=np.empty(shape,dtype=np.float32)
+            map_y=np.empty(shape,dtype=np.float32)
+            _distortion_grid(dc.affine.ravel(),dc.xc,dc.yc,map_x,map_y)
 
-        yfit2=dc.yc00+(dc.yc10*x)+(dc.yc20*x**2)+(dc.yc30*x**3)+(dc.yc01*y)+(dc.yc11*x*y)+(dc.yc21*x**2*y)\
-                +(dc.yc02*y**2)+(dc.yc12*x*y**2)+(dc.yc03*y**3)
+        dc._grid_cache=(map_x,map_y)
+        return map_x,map_y
 
-        xfit=xfit1+xfit2
-        yfit=yfit1+yfit2
+    def fitLocation(self,uncorrectXY,dc):
 
-        if type(xfit) is np.ndarray:
-            xfit[np.where(xfit < 0)]=0
-            xfit[np.where(xfit > 2047)]=2047
-        else:
-           np.clip(xfit,0,2047)
+        x,y=uncorrectXY
 
-        if type(yfit) is np.ndarray:
-            yfit[np.where(yfit < 0)]=0
-            yfit[np.where(yfit > 2047)]=2047
-        else:
-            np.clip(yfit,0,2047)
+        xfit,yfit=dc.eval_xy(x,y)
 
-        indx=np.uint(np.round(xfit))
-        indy=np.uint(np.round(yfit))
+        xfit=np.clip(xfit,0,2047)
+        yfit=np.clip(yfit,0,2047)
 
-        return indx,indy
+        return xfit,yfit
 
     def mosaicField(self):
         ''''''
 
-        ''' Prepare a 2d array '''
-        temp1=np.zeros((2048,3636))
-
-        ''' Shift the channel 1 image '''
-        temp1[:,0:2048]=self.star.remap1.data[:,:]
-
-        '''Operate on channel2'''
-        temp2=np.zeros((2048,3636))
-        temp2[:,0:2048]=self.star.remap2.data
-
-        y,x=np.mgrid[0:temp2.shape[0],0:temp2.shape[1]]
+        ''' Size of the mosaic; channel 1 fills the first 2048 columns '''
+        shape=(2048,3636)
 
         '''Loading mosaic parameter'''
         #mc2=MosaicParameterCh2()
         mc2=self.mc2
-        xfit=mc2.a+mc2.b*x+mc2.c*y
-        yfit=mc2.d+mc2.e*x+mc2.f*y
+        if mc2._grid_cache is None:
+            y,x=np.mgrid[0:shape[0],0:shape[1]]
+            xfit,yfit=mc2.apply_affine((x,y))
 
-        ''' Arranging indexes in correct range'''
-        xfit[np.where(xfit < 0)]=0
-        yfit[np.where(yfit < 0)]=0
-        xfit[np.where(xfit > 2047)]=2047
-        yfit[np.where(yfit > 2047)]=2047
+            ''' Arranging indexes in correct range'''
+            xfit[np.where(xfit < 0)]=0
+            yfit[np.where(yfit < 0)]=0
+            xfit[np.where(xfit > 2047)]=2047
+            yfit[np.where(yfit > 2047)]=2047
 
-        ''' Round the float numbers to integer'''
-        indx=np.uint(np.round(xfit))
-        indy=np.uint(np.round(yfit))
+            mc2._grid_cache=(xfit.astype(np.float32),yfit.astype(np.float32))
+        map_x,map_y=mc2._grid_cache
 
-        remap=temp2[indy,indx]
+        '''Operate on channel2; the maps are clipped to the 2048x2048 chip,
+        so it is sampled directly and the output takes the mosaic shape'''
+        remap=cv2.remap(self.star.remap2.data.astype(np.float32, copy=False),
+                        map_x,map_y,cv2.INTER_LINEAR,
+                        borderMode=cv2.BORDER_CONSTANT)
 
-        img=temp1*np.subtract(1,self.badpix.ch1.data)+remap*np.subtract(1,self.badpix.ch2.data)
+        ''' Add the channel 1 image, which is zero outside its columns '''
+        img=remap*self.badpix.w2
+        img[:,0:2048]+=self.star.remap1.data*self.badpix.w1[:,0:2048]
 
-        avg=np.median(img)
+        # the median of every 8th row and column is close enough for the
+        #  background level and touches 1/64 of the pixels
+        avg=np.median(img[::8,::8])
         img=np.add(0.5*avg,0.5*img)
 
         self.star.mosaic=fits.PrimaryHDU(data=shift(np.rot90(img, k=3),[33.5,0],order=0)[67:,:],
@@ -3548,20 +3636,33 @@ class MoircsAlignImage:
 
     def loadImage(self):
 
-        self.star.raw1 = fits.open(self.imagepath+'MCSA%08d.fits'% self.star_fits_name[0],memmap=False)[0]
-        self.star.raw2 = fits.open(self.imagepath+'MCSA%08d.fits'% self.star_fits_name[1],memmap=False)[0]
+        frames=(self.star_fits_name[0],self.star_fits_name[1],
+                self.sky_fits_name[0],self.sky_fits_name[1],
+                self.mask_fits_name[0],self.mask_fits_name[1])
+        paths=[self.imagepath+'MCSA%08d.fits'% n for n in frames]
+        paths+=[self.badpix_fits_name[0]+'.fits',
+                self.badpix_fits_name[1]+'.fits']
 
-        self.star.bg1 = fits.open(self.imagepath+'MCSA%08d.fits'% self.sky_fits_name[0],memmap=False)[0]
-        self.star.bg2 = fits.open(self.imagepath+'MCSA%08d.fits'% self.sky_fits_name[1],memmap=False)[0]
+        # The files are independent, so read them concurrently
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            hdus=list(executor.map(self.openImage,paths))
 
-        self.mask.ch1=fits.open(self.imagepath+'MCSA%08d.fits'% self.mask_fits_name[0],memmap=False)[0]
-        self.mask.ch2=fits.open(self.imagepath+'MCSA%08d.fits'% self.mask_fits_name[1],memmap=False)[0]
+        (self.star.raw1,self.star.raw2,self.star.bg1,self.star.bg2,
+         self.mask.ch1,self.mask.ch2,self.badpix.ch1,self.badpix.ch2)=hdus
 
-        self.badpix.ch1=fits.open(self.badpix_fits_name[0]+'.fits',memmap=False)[0]
-        self.badpix.ch2=fits.open(self.badpix_fits_name[1]+'.fits',memmap=False)[0]
+        # good-pixel weights used by mosaicField
+        self.badpix.w1=np.subtract(1,self.badpix.ch1.data,dtype=np.float32)
+        self.badpix.w2=np.subtract(1,self.badpix.ch2.data,dtype=np.float32)
 
         self.loadDistorCoeff()
 
+    @staticmethod
+    def openImage(path):
+        hdu=fits.open(path,memmap=False)[0]
+        # touch the data so the pixels are read in the calling thread
+        hdu.data
+        return hdu
+
     def loadDistorCoeff(self):
 
         try:
@@ -3574,8 +3675,6 @@ class MoircsAlignImage:
         except IOError as err:
             raise IOError
 
-        attrs = vars(self.mc2)
-        print(', '.join("%s: %s" % item for item in attrs.items()))
         #print(self.dcc2.a,self.dcc2.xc00)
 
     def extractStar(self):
@@ -3583,7 +3682,15 @@ class MoircsAlignImage:
         data=self.star.mosaic.data
         m, s = np.mean(data), np.std(data)
         bkg = sep.Background(data, bw=64, bh=64, fw=3, fh=3)
-        objs = sep.extract(data-bkg, 2.5, err=bkg.globalrms,minarea=20)
+
+        # Mask the rows outside the usable field (the edges and the gap
+        #  between the chips) so sep does not detect anything there.
+        mask = np.zeros(data.shape, dtype=bool)
+        mask[:121] = True
+        mask[1800:1861] = True
+        mask[3530:] = True
+        objs = sep.extract(data-bkg, 2.5, err=bkg.globalrms,minarea=20,
+                           mask=mask)
 
         aper_radius=8.0
 
@@ -3615,15 +3722,13 @@ class MoircsAlignImage:
         #objs['flag'][einx]=flag
         objs['flag'][cinx]=cflag
 
-        #eliminate unwanted sources
-        index=np.logical_and(objs['b']/objs['a'] > 0.1,
-                        np.logical_and(flag >= 0,np.logical_or(\
-            np.logical_and(objs['y'] > 120, objs['y'] < 1800),\
-            np.logical_and(objs['y'] > 1860, objs['y'] < 3530))))
-
-        objects=objs[:][np.where(index)]
-
-        self.starCat=objects[:]
+        #eliminate unwanted sources; the mask keeps sep from working on
+        # the rows outside the field, but an object detected next to them
+        # can still have its centroid there
+        y = objs['y']
+        in_field = (((y > 120) & (y < 1800)) | ((y > 1860) & (y < 3530)))
+        self.starCat=objs[(objs['b']/objs['a'] > 0.1) & (flag >= 0) &
+                          in_field]
 
         # fig, ax = plt.subplots()
         # im = ax.imshow(np.flipud(data), interpolation='nearest', cmap='gray',
@@ -3655,28 +3760,20 @@ class MoircsAlignImage:
         # The limit of N nearest stars around the holes.
         nlimit=5
 
-        darray=np.array([])
-        for i in self.mask.gHoleMosaic[0,:]:
-            d = np.sqrt( (i[0] - np.array([self.starCat['x']]))**2 +
-                (i[1] - np.array([self.starCat['y']]))**2 )
-            if darray.shape[0] == 0:
-                darray=d
-            else:
-                darray=np.vstack((darray,d))
-
-        # Extracting the nearest N stars for searching
-        nearest_dis=np.array([])
-        nearest_ind=np.array([])
-        for i in range(len(self.mask.gHoleMosaic[0,:,0])):
-            if nearest_dis.shape[0] == 0:
-                nearest_dis = darray[i,darray[i,0:].argsort()[0:nlimit]]
-            else:
-                nearest_dis=np.vstack((nearest_dis,darray[i,darray[i,0:].argsort()[0:nlimit]]))
-
-            if nearest_ind.shape[0] == 0:
-                nearest_ind = darray[i,0:].argsort()[0:nlimit]
-            else:
-                nearest_ind=np.vstack((nearest_ind,darray[i,0:].argsort()[0:nlimit]))
+        # Distances from every hole (rows) to every star (columns)
+        holes=self.mask.gHoleMosaic[0]
+        darray=np.hypot(holes[:,0:1]-self.starCat['x'][np.newaxis,:],
+                        holes[:,1:2]-self.starCat['y'][np.newaxis,:])
+
+        # Extracting the nearest N stars for searching; only those N are
+        #  sorted
+        if darray.shape[1] > nlimit:
+            part=np.argpartition(darray,nlimit,axis=1)[:,0:nlimit]
+            order=np.take_along_axis(darray,part,axis=1).argsort(axis=1)
+            nearest_ind=np.take_along_axis(part,order,axis=1)
+        else:
+            nearest_ind=darray.argsort(axis=1)
+        nearest_dis=np.take_along_axis(darray,nearest_ind,axis=1)
 
         print(nearest_dis)
         print(nearest_ind)
@@ -3686,86 +3783,54 @@ class MoircsAlignImage:
         si,sj=np.where(nearest_dis == np.min(nearest_dis))
 
         # Now looking for matched stars by checking distances, go through
-        #  all N-th nearest stars and find their friends.
-        match_set=Bunch()
-        weight_set=Bunch()
-        for i in range(nlimit):
-
-            # Using this distance for friend-looking
-            dmin_template=nearest_dis[si,i]
-
-            #print('templat from ',nearest_dis[si,i])
-
-            # subtract this distance
-            matrix_dis=np.abs(np.subtract(nearest_dis,dmin_template))
-
-            # Initiate two arrays for the storage of the pari indexes and
-            #  distances
-            sub_match_set=np.array([])
-            sub_distance=np.array([])
-
-            # Pick the star with minimum distance to a hole from each row
-            for x in range(matrix_dis.shape[0]):
-                temp_dis = np.array(matrix_dis[x:x+1,:])
-                temp_ind = np.array(nearest_ind[x:x+1,:])
-
-                # Set the selection condition for stars
-                index=np.logical_and(temp_dis < 20, \
-                    temp_dis == np.min(temp_dis))
-
-                #print(temp_dis)
-                #print(temp_ind[np.where(index)])
-                if len(temp_ind[np.where(index)]) == 0:
-                    sub_match_set=np.append(sub_match_set,np.nan)
-                    sub_distance=np.append(sub_distance,np.nan)
-                else:
-                    sub_match_set=np.append(sub_match_set,\
-                        temp_ind[np.where(index)])
-                    sub_distance=np.append(sub_distance,\
-                        temp_dis[np.where(index)])
-
-                #print(sub_match_set)
-                #print('-------')
-
-            # When storing the match set, remove all NaN elements.  The NaN are
-            #  used to calculate the weighting, so that we do not want to change
-            #  it in original array.  The weighting is based on 1) the standard
-            #  deviation, 2) the number of associated stars and 3) the distances.
-            match_set['set'+str(i)]=np.uint16(
-                sub_match_set[np.where(~np.isnan(sub_match_set))]
-                )
-            weight_set['set'+str(i)]=\
-                np.std(sub_distance[np.where(~np.isnan(sub_distance))])*\
-                float(dmin_template[0])*\
-                (np.count_nonzero(np.isnan(sub_distance))+1)**3
-            print(np.std(sub_distance[np.where(~np.isnan(sub_distance))]))
-            print(np.mean(sub_distance[np.where(~np.isnan(sub_distance))]))
-            print((np.count_nonzero(np.isnan(sub_distance))+1))
-            print(dmin_template)
+        #  all N-th nearest stars and find their friends.  Each of the N
+        #  distances of the reference hole is used as a template at once:
+        #  diff[i] is the distance table minus the i-th template.
+        dmin_template=nearest_dis[si[0],:]
+        diff=np.abs(nearest_dis[np.newaxis,:,:]-
+                    dmin_template[:,np.newaxis,np.newaxis])
+
+        # Pick the star with minimum distance to a hole from each row, as
+        #  long as it is within 20 pixels of the template.  sub_distance is
+        #  NaN for the rows without one.
+        row_min=diff.min(axis=2)
+        col=diff.argmin(axis=2)
+        valid=row_min < 20
+        sub_match_set=nearest_ind[np.arange(nearest_ind.shape[0]),col]
+        sub_distance=np.where(valid,row_min,np.nan)
+
+        # The weighting is based on 1) the standard deviation, 2) the number
+        #  of associated stars and 3) the distances.
+        weights=np.nanstd(sub_distance,axis=1)*dmin_template*\
+            (np.count_nonzero(~valid,axis=1)+1)**3
+
+        # When storing the match set, remove all unmatched rows.  Unused
+        #  slots are marked with -1.
+        match_sets=np.full(sub_match_set.shape,-1,dtype=np.int32)
+        for i in range(len(dmin_template)):
+            clean=sub_match_set[i][valid[i]]
+            match_sets[i,:len(clean)]=clean
 
         # When there is only one star detected in the hole, the STD=0 and
         #  the rest weighting will not working.  This is the fix
+        best=0
         weight_min=0
-        for i in weight_set.items():
+        for i,weight in enumerate(weights):
             if weight_min == 0:
-                weight_min = i[1]
-                stars=match_set[i[0]]
-            elif (i[1] < weight_min and i[1] != 0):
-                weight_min = i[1]
-                stars=match_set[i[0]]
-
-        print(match_set)
-        print(weight_set)
+                weight_min=weight
+                best=i
+            elif (weight < weight_min and weight != 0):
+                weight_min=weight
+                best=i
+        stars=match_sets[best]
+        stars=stars[stars >= 0]
+
         print(stars)
         #stars=match_set[min(weight_set,key=weight_set.get)]
 
         #print(self.starCat['x'][stars], self.starCat['y'][stars])
-        for i in range(0,len(self.starCat['x'][stars])):
-            print([self.starCat['x'][stars[i]],self.starCat['y'][stars[i]]])
-            if i == 0:
-                self.starMat= np.array([self.starCat['x'][stars[i]],self.starCat['y'][stars[i]]])
-            else:
-                self.starMat=np.vstack((self.starMat,[self.starCat['x'][stars[i]],self.starCat['y'][stars[i]]]))
+        self.starMat=np.column_stack((self.starCat['x'][stars],
+                                      self.starCat['y'][stars]))
 
         # plt.close('all')
         # fig, ax = plt.subplots()
@@ -3793,14 +3858,14 @@ class MoircsAlignImage:
         # plt.close()
 
     def closeImage(self):
-        if self.star != 0:
-            del self.star
-
-        if self.mask != 0:
-            del self.mask
-
-        if self.badpix !=0:
-            del self.badpix
+        # Clear every entry as well as the Bunch itself, so the images are
+        #  freed even if something else still holds on to the Bunch
+        for key in ('star','mask','badpix'):
+            images=getattr(self,key)
+            if images is not None:
+                for name in images:
+                    images[name]=None
+                setattr(self,key,None)
 
     def __init__(self):
         #super().__init__()
@@ -3810,8 +3875,8 @@ class MoircsAlignImage:
         #self.mc2=MoircsAlignConfig().mc2
 
         self.starCat=0
-        self.starMat
-        self.badpix=Bunch(dict(ch1=0,ch2=0))
+        self.starMat=None
+        self.badpix=Bunch(dict(ch1=0,ch2=0,w1=0,w2=0))
 
         self.mask=Bunch(dict(ch1=0,ch2=0,mosaic=0,ch1_gHoles=0,
                     ch2_gHoles=0,ch1_gHolesCorr=0,ch2_gHolesCorr=0,gHoleMosaic=0))
@@ -3821,114 +3886,214 @@ class MoircsAlignImage:
 
     def __del__(self):
         self.closeImage()
-        gc.collect()
+
+
+def _float_column(column):
+    """
+    Convert a text column of a calibration file to float64 in one pass
+    @param column:
+        The text cells of one column
+    @returns:
+        A float64 array with NaN for the cells that are not numbers
+    """
+    text=np.char.strip(np.asarray(column,dtype=str))
+    # numbers are the cells starting with a digit, a sign or a point
+    numeric=np.isin(text.astype('U1'),list('0123456789+-.'))
+    field=np.full(text.shape,np.nan)
+    field[numeric]=text[numeric].astype(np.float64)
+    return field
+
+
+# (x power, y power) of each element of DistortionMap.xc/yc
+_POLY_POWERS=(np.array([0,1,2,3,0,1,2,0,1,0]),
+              np.array([0,0,0,0,1,1,1,2,2,3]))
+
+
+def _last_geomap_entry(filename, tail=8192):
+    """
+    Split the lines of the last entry of an IRAF geomap database, reading
+    only the end of the file when the entry fits in it
+    @param filename:
+        The database file
+    @param tail:
+        The number of bytes to try first
+    @returns:
+        A list with the whitespace-separated fields of each line after the
+        last 'begin' line, with blank and comment lines skipped
+    """
+    with open(filename,'rb') as f:
+        f.seek(0,os.SEEK_END)
+        size=f.tell()
+        start=max(0,size-tail)
+        f.seek(start)
+        lines=f.read().decode('ascii','replace').splitlines()
+    if start > 0:
+        # the first line is probably cut
+        lines=lines[1:]
+
+    rows=[line.split() for line in lines]
+    rows=[row for row in rows if row and not row[0].startswith('#')]
+    begins=[i for i,row in enumerate(rows) if row[0] == 'begin']
+    if not begins and start > 0:
+        return _last_geomap_entry(filename,tail=size)
+    if begins:
+        return rows[begins[-1]+1:]
+    return rows
+
+
+@functools.lru_cache(maxsize=32)
+def _read_coefficients(filename, mtime):
+    """
+    The coefficients of a distortion database, kept for the session so the
+    same file is only read once.  mtime is part of the key so an updated
+    file is read again.  The arrays are shared between instances; do not
+    modify them.
+    """
+    reader=DistortionMap.__new__(DistortionMap)
+    reader.filename=filename
+    reader.readDataFile()
+    return {name: getattr(reader,name) for name in DistortionMap.coeff_names}
+
+
+def _apply_affine(affine, xy):
+    """
+    Apply a 2x3 affine matrix [[a,b,c],[d,e,f]] to coordinates
+    @param xy:
+        The x and y coordinates, as arrays of the same shape
+    @returns:
+        A (2,...) array of (a+b*x+c*y, d+e*x+f*y)
+    """
+    x,y=np.broadcast_arrays(*xy)
+    points=np.empty((3,)+x.shape)
+    points[0]=1
+    points[1]=x
+    points[2]=y
+    return (affine @ points.reshape(3,-1)).reshape((2,)+x.shape)
+
+
+def _coeff_property(name, index):
+    """ Read-only scalar view of one element of a coefficient array """
+    return property(lambda self: float(getattr(self,name)[index]))
 
 
 class DistortionMap:
+    """
+    Distortion correction of one MOIRCS channel, read from an IRAF geomap
+    database.  affine holds the linear terms as [[a,b,c],[d,e,f]]; xc and
+    yc hold the cubic terms in the order 00,10,20,30,01,11,21,02,12,03 of
+    the database.
+    """
 
     filename=""
 
+    # names of the coefficient attributes set by readDataFile
+    coeff_names=('affine','xc','yc')
+
+    # rows of the last database entry holding the coefficients; row k is
+    #  line k+1 after 'begin', so these are lines 24-26 and 36-45
+    _linear_rows=slice(23,26)
+    _cubic_rows=slice(35,45)
+
+    # (map_x,map_y) grid from MoircsAlignImage.transformGrid
+    _grid_cache=None
+
+    # the individual coefficients under their old names
+    a,b,c=(_coeff_property('affine',(0,i)) for i in range(3))
+    d,e,f=(_coeff_property('affine',(1,i)) for i in range(3))
+    (xc00,xc10,xc20,xc30,xc01,
+     xc11,xc21,xc02,xc12,xc03)=(_coeff_property('xc',i) for i in range(10))
+    (yc00,yc10,yc20,yc30,yc01,
+     yc11,yc21,yc02,yc12,yc03)=(_coeff_property('yc',i) for i in range(10))
+
     def __init__ (self,filename):
         self.filename=filename
-        self.readDataFile()
+        self.__dict__.update(_read_coefficients(filename,
+                                                os.stat(filename).st_mtime_ns))
 
     def readDataFile(self):
-        data=ascii.read(self.filename)
-
-        field0 = []
-        for x in data['begin'].data :
-            try:
-                field0.append(float(x))
-            except ValueError:
-                field0.append(x)
-        field1 = []
-
-        for x in data.field(1).data :
-            try:
-                field1.append(float(x))
-            except ValueError:
-                field1.append(x)
-
-        np.sum(data['begin'] == 'begin')
-        if np.sum(data['begin'] == 'begin') != 0:
-            ind=np.array(np.where(data['begin'] == 'begin'))
-        else:
-            ind = np.array([-1])
-
-        self.a=field0[int(ind[-1])+24]
-        self.b=field0[int(ind[-1])+25]
-        self.c=field0[int(ind[-1])+26]
-        self.d=field1[int(ind[-1])+24]
-        self.e=field1[int(ind[-1])+25]
-        self.f=field1[int(ind[-1])+26]
-
-        self.xc00=field0[int(ind[-1])+36]
-        self.xc10=field0[int(ind[-1])+37]
-        self.xc20=field0[int(ind[-1])+38]
-        self.xc30=field0[int(ind[-1])+39]
-        self.xc01=field0[int(ind[-1])+40]
-        self.xc11=field0[int(ind[-1])+41]
-        self.xc21=field0[int(ind[-1])+42]
-        self.xc02=field0[int(ind[-1])+43]
-        self.xc12=field0[int(ind[-1])+44]
-        self.xc03=field0[int(ind[-1])+45]
-
-        self.yc00=field1[int(ind[-1])+36]
-        self.yc10=field1[int(ind[-1])+37]
-        self.yc20=field1[int(ind[-1])+38]
-        self.yc30=field1[int(ind[-1])+39]
-        self.yc01=field1[int(ind[-1])+40]
-        self.yc11=field1[int(ind[-1])+41]
-        self.yc21=field1[int(ind[-1])+42]
-        self.yc02=field1[int(ind[-1])+43]
-        self.yc12=field1[int(ind[-1])+44]
-        self.yc03=field1[int(ind[-1])+45]
+        rows=_last_geomap_entry(self.filename)
+        field0=np.array([row[0] for row in rows])
+        field1=np.array([row[1] if len(row) > 1 else '' for row in rows])
+
+        self.affine=np.array([_float_column(field0[self._linear_rows]),
+                              _float_column(field1[self._linear_rows])])
+        self.xc=_float_column(field0[self._cubic_rows])
+        self.yc=_float_column(field1[self._cubic_rows])
+
+    def apply_affine(self,xy):
+        """
+        Apply only the linear part of the correction
+        @param xy:
+            The x and y coordinates
+        @returns:
+            A (2,...) array of the transformed x and y
+        """
+        return _apply_affine(self.affine,xy)
+
+    def polyCoeffs(self):
+        """
+        The full transformation as 4x4 bivariate coefficient matrices,
+        c[i,j] being the coefficient of x**i * y**j
+        @returns:
+            The (cx,cy) matrices for numpy.polynomial.polynomial.polyval2d
+        """
+        cx=np.zeros((4,4))
+        cy=np.zeros((4,4))
+        cx[_POLY_POWERS]=self.xc
+        cy[_POLY_POWERS]=self.yc
+        # fold the linear terms into the constant and first order terms
+        cx[0,0]+=self.affine[0,0]
+        cx[1,0]+=self.affine[0,1]
+        cx[0,1]+=self.affine[0,2]
+        cy[0,0]+=self.affine[1,0]
+        cy[1,0]+=self.affine[1,1]
+        cy[0,1]+=self.affine[1,2]
+        return cx,cy
+
+    def eval_xy(self,x,y):
+        """
+        Apply the distortion correction, without clipping to the chip
+        @param x, y:
+            Arrays of uncorrected coordinates
+        @returns:
+            The corrected x and y
+        """
+        cx,cy=self.polyCoeffs()
+        return polyval2d(x,y,cx),polyval2d(x,y,cy)
 
 
 class MosaicPrarameter:
+    """
+    Placement of channel 2 in the mosaic.  The coefficients in the database
+    are not used; the values below have always overridden them.
+    """
 
     filename=""
 
+    a=-1602.189
+    b=0.9993759
+    c=0.009615554
+    d=40.30523
+    e=-0.009611026
+    f=0.9998468
+
+    affine=np.array([[a,b,c],[d,e,f]])
+
+    # (map_x,map_y) grid from MoircsAlignImage.mosaicField
+    _grid_cache=None
+
     def __init__ (self,filename):
         self.filename=filename
-        self.readDataFile()
 
-    def readDataFile(self):
-        data=ascii.read(self.filename)
-
-        field0 = []
-        for x in data['begin'].data :
-            try:
-                field0.append(float(x))
-            except ValueError:
-                field0.append(x)
-        field1 = []
-
-        for x in data.field(1).data :
-            try:
-                field1.append(float(x))
-            except ValueError:
-                field1.append(x)
-
-        np.sum(data['begin'] == 'begin')
-        if np.sum(data['begin'] == 'begin') != 0:
-            ind=np.array(np.where(data['begin'] == 'begin'))
-        else:
-            ind = np.array([-1])
-
-        self.a=field0[int(ind[-1])+24]
-        self.b=field0[int(ind[-1])+25]
-        self.c=field0[int(ind[-1])+26]
-        self.d=field1[int(ind[-1])+24]
-        self.e=field1[int(ind[-1])+25]
-        self.f=field1[int(ind[-1])+26]
-
-        self.a=-1602.189
-        self.b=0.9993759
-        self.c=0.009615554
-        self.d=40.30523
-        self.e=-0.009611026
-        self.f=0.9998468
+    def apply_affine(self,xy):
+        """
+        Map channel-2 coordinates into the mosaic
+        @param xy:
+            The x and y coordinates
+        @returns:
+            A (2,...) array of the transformed x and y
+        """
+        return _apply_affine(self.affine,xy)
 
 
 # class DistortionCoeffCh1:
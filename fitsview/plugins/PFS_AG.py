@@ -59,12 +59,15 @@ import re
 import time
 import threading
 import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # 3rd party
 import numpy as np
 from fitsio import FITS
 # pip install inotify
 import inotify.adapters
+import inotify.constants
 import yaml
 
 # ginga
@@ -86,6 +89,46 @@ from fitsview.util import pfswcs
 # guide star filter flags
 flag_galaxy = 4096
 
+# table columns used for plotting; other columns are not read
+go_columns = ['camera_id', 'filter_flag', 'x', 'y']
+io_columns = ['detected_object_id', 'guide_object_id', 'matched',
+              'camera_id', 'detected_object_x_pix', 'detected_object_y_pix',
+              'guide_object_x_pix', 'guide_object_y_pix']
+
+# inotify events that signal a new file in the data directory
+watch_events = frozenset(['IN_MOVED_TO', 'IN_CLOSE_WRITE'])
+
+
+def reduce_frame(data, subtract_bias, subtract_bg):
+    """Subtract the overscan bias and/or the background from AG frame
+    `data`.  This does not touch the plugin, so it can be run in a worker
+    thread.
+    """
+    ht, wd = data.shape[:2]
+    # overscans - 24 pixels at the beginning and end of each row (X)
+    # and first 9 rows (Y).
+    ovsc_x, ovsc_y = 24, 9
+
+    # integer frames cannot hold NaNs, so the plain (partition based)
+    # median can be used instead of the much slower nanmedian
+    median = np.median if data.dtype.kind in 'iu' else np.nanmedian
+
+    if subtract_bias or subtract_bg:
+        # a single float32 working copy; the steps below work in place
+        data = data.astype(np.float32)
+
+    if subtract_bias:
+        overscan = data[0:ovsc_y + 1, :]
+        medians = median(overscan, axis=0)
+        # broadcast the column medians over the rows
+        np.subtract(data, medians[np.newaxis, :], out=data)
+
+    if subtract_bg:
+        med = median(data[ovsc_y:ht, ovsc_x:wd - ovsc_x])
+        np.subtract(data, med, out=data)
+
+    return data
+
 
 class PFS_AG(GingaPlugin.GlobalPlugin):
 
@@ -134,14 +177,18 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
         self.exp_id = ''
         self.recv_time = ''
         self.ev_quit = threading.Event()
-        # self.dark = dict()
-        # self.flat = dict()
+        self.dark = dict()
+        self.flat = dict()
         # self.cmap_names = list(cmap.get_names())
         # self.cmap = cmap.get_cmap(self.settings.get('color_map'))
         # self.imap_names = list(imap.get_names())
         # self.imap = imap.get_imap(self.settings.get('intensity_map'))
         # self.field_names = ['mag']
         # self.field = 'mag'
+        # worker threads for reducing the camera frames
+        self._pool = None
+        # raw camera images of the current file, by camera name
+        self._raw_cam = {}
         self.pause_flag = False
         self.rate_limit = self.settings.get('rate_limit', 5.0)
         self.error_scale = 1.0
@@ -163,6 +210,8 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
         self._fov_coords = dict()
 
         self.viewer = dict()
+        # (channel, viewer, canvas) of each guide camera, by number 1-6
+        self._cam_cache = dict()
         self.dc = fv.get_draw_classes()
 
         # controls how far from the center we plot the guide cam images
@@ -218,6 +267,7 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
                 lbl.crdmap = viewer.get_coordmap('window')
                 canvas = viewer.get_canvas()
                 canvas.add(lbl, redraw=False)
+                self._cam_cache[idx + 1] = (channel, viewer, canvas)
 
         # create "big picture" FOV channel
         chname = self.fov_chname
@@ -290,13 +340,11 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
         b.subtract_bias.set_state(tf)
         b.subtract_bias.add_callback('activated', self.subtract_bias_cb)
         b.subtract_bias.set_tooltip("Subtract bias calculated from overscan region")
-        top.add_widget(w, stretch=0)
 
         tf = self.settings.get('subtract_background', False)
         b.subtract_background.set_state(tf)
         b.subtract_background.add_callback('activated', self.subtract_bg_cb)
         b.subtract_background.set_tooltip("Subtract background calculated from image")
-        top.add_widget(w, stretch=0)
 
         # tf = self.settings.get('subtract_dark', False)
         # b.subtract_dark.set_state(tf)
@@ -315,9 +363,6 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
         # b.flat_frames.add_callback('activated', self.set_flats_cb)
         # b.flat_frames.set_tooltip("Enter a file that contains flat frames")
 
-        b.pause.set_state(self.pause_flag)
-        b.pause.add_callback('activated', self.pause_cb)
-        b.pause.set_tooltip("Pause updates")
         b.pause.set_state(self.pause_flag)
         b.pause.add_callback('activated', self.pause_cb)
         b.pause.set_tooltip("Pause updates")
@@ -485,6 +530,9 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
 
     def start(self):
         self.ev_quit.clear()
+        # numpy releases the GIL in the medians and subtractions, so
+        # threads reduce the cameras in parallel without copying frames
+        self._pool = ThreadPoolExecutor(max_workers=3)
         if self._in_gen2:
             self.fv.nongui_do(self.watch_loop, self.ev_quit)
 
@@ -492,6 +540,10 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
 
     def stop(self):
         self.ev_quit.set()
+        self._cam_cache = dict()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
 
         # delete channels created by this plugin
         for idx in range(0, 6):
@@ -541,23 +593,14 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
 
         self.fv.nongui_do(self.process_file, filepath, set_1k=True)
 
-    def quick_data_reduce(self, image, name):
-        data = image.get_data()
-        wd, ht = image.get_size()[:2]
-        # overscans - 24 pixels at the beginning and end of each row (X)
-        # and first 9 rows (Y).
-        ovsc_x, ovsc_y = 24, 9
-
-        if self.settings.get('subtract_bias', False):
-            rows, columns = data.shape[:2]
-            overscan = data[0:ovsc_y + 1, :]
-            medians = np.nanmedian(overscan, axis=0).reshape((1, columns))
-            subtrahend = np.repeat(medians, rows, axis=0)
-            data = data - subtrahend
-
-        if self.settings.get('subtract_background', False):
-            med = np.nanmedian(data[ovsc_y:ht, ovsc_x:wd - ovsc_x])
-            data = data - med
+    def quick_data_reduce(self, image, name, data=None):
+        """Return a new image holding the reduced data of `image`.
+        If `data` is given it is taken as already reduced.
+        """
+        if data is None:
+            data = reduce_frame(image.get_data(),
+                                self.settings.get('subtract_bias', False),
+                                self.settings.get('subtract_background', False))
 
         # if self.settings.get('subtract_dark', False):
         #     if len(self.dark) == 0:
@@ -590,18 +633,14 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
 
         self.img_dct = img_dct
         self.fv.assert_gui_thread()
-        for cam_num in (1, 2, 3, 4, 5, 6):
+        for cam_num, (channel, viewer, canvas) in self._cam_cache.items():
             cam_id = 'CAM{}'.format(cam_num)
-            if self.fv.has_channel(cam_id):
-                channel = self.fv.get_channel(cam_id)
-                viewer = channel.viewer
-                if cam_id in img_dct:
-                    image = img_dct[cam_id]
-                    image.set(tag=cam_id)
-                    canvas = viewer.get_canvas()
-                    channel.add_image(image)
-                else:
-                    viewer.clear()
+            if cam_id in img_dct:
+                image = img_dct[cam_id]
+                image.set(tag=cam_id)
+                channel.add_image(image)
+            else:
+                viewer.clear()
 
         self.auto_orient()
 
@@ -610,8 +649,6 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
         self.w.exp_id.set_text(self.exp_id)
         self.w.recv_time.set_text(self.recv_time)
 
-        self.fv.update_pending()
-
         if self._in_gen2:
             # increment the guide count
             self.guide_count += 1
@@ -750,7 +787,9 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
         self.tbl_go = None
         self.tbl_do = None
         self.tbl_io = None
+        self._raw_cam = {}
         img_dct = {}
+        cam_images = {}
         wcses = None
 
         fits_f = None
@@ -768,6 +807,10 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
                     # load camera image
                     name = hdu_name.strip()
                     cam_num = int(name[-1])
+                    if not hdu.has_data():
+                        # <-- empty data area--possibly dead camera;
+                        # found from the header without reading anything
+                        continue
 
                     #imname = fname + f'[{name}]'
                     imname = f'{name}'
@@ -778,7 +821,6 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
                     image.set(name=imname)
                     data = image.get_data()
                     if len(data) == 0:
-                        # <-- empty data area--possibly dead camera
                         continue
 
                     # make a WCS for the image if it doesn't have one
@@ -795,36 +837,33 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
                         image.set(path=path)
                         self.fv.gui_do(self.set_1k, image)
 
-                    # perform any desired subtractions
-                    image = self.quick_data_reduce(image, name)
                     #image.set(path=f"{path}[{idx}]")
-
-                    # for later updating the images in the grid of viewers
-                    img_dct[name] = image
+                    cam_images[name] = image
 
                 elif hdu_name == 'detected_objects':
-                    self.logger.info('reading do table')
-                    self.tbl_do = hdu.read()
+                    # not read: the detected positions that are plotted
+                    # come with the identified objects table
+                    pass
 
                 elif hdu_name == 'guide_objects':
                     self.logger.info('reading go table')
-                    self.tbl_go = hdu.read()
+                    self.tbl_go = self.read_table(hdu, go_columns)
 
                 elif hdu_name == 'identified_objects':
                     self.logger.info('reading io table')
-                    self.tbl_io = hdu.read()
+                    self.tbl_io = self.read_table(hdu, io_columns)
 
                 else:
                     self.logger.info("Unrecognized HDU: name='{}'".format(hdu_name))
             self.logger.info('read all HDUs')
 
-            # determine max and min magnitude
-            if self.tbl_go is not None:
-                mags = self.tbl_go['mag']
-                #self.mag_max = np.max(mags)
-                #self.mag_min = np.min(mags)
+            # keep the raw camera images, so that a change of the
+            # reduction settings does not need to reread the file
+            self._raw_cam = cam_images
+
+            # perform any desired subtractions
+            img_dct = self.reduce_images(cam_images)
 
-            self.logger.info('determined minmax')
             end_time = time.time()
             self.logger.info("file processing time %.4f sec" % (end_time - start_time))
 
@@ -838,6 +877,61 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
         finally:
             fits_f = None
 
+    def reduce_images(self, cam_images):
+        """Reduce the raw camera images in `cam_images`, in parallel in the
+        worker pool if it is running.  Returns a dict of the reduced images
+        by camera name.
+        """
+        subtract_bias = self.settings.get('subtract_bias', False)
+        subtract_bg = self.settings.get('subtract_background', False)
+        pool = self._pool
+        if pool is not None and (subtract_bias or subtract_bg):
+            futures = {name: pool.submit(reduce_frame, image.get_data(),
+                                         subtract_bias, subtract_bg)
+                       for name, image in cam_images.items()}
+            reduced = {}
+            for name, future in futures.items():
+                try:
+                    reduced[name] = future.result()
+
+                except Exception as e:
+                    # quick_data_reduce will reduce this one in-line
+                    self.logger.error("Error reducing {} in pool: {}".format(
+                        name, e), exc_info=True)
+        else:
+            reduced = {}
+
+        return {name: self.quick_data_reduce(image, name,
+                                             data=reduced.get(name))
+                for name, image in cam_images.items()}
+
+    def _rereduce(self):
+        """Reduce the cached raw camera images of the current file again
+        and show them in the viewers.
+        """
+        self.fv.assert_nongui_thread()
+        try:
+            img_dct = self.reduce_images(self._raw_cam)
+            self.fv.gui_do_oneshot('pfsag_update', self.update_grid, img_dct)
+
+        except Exception as e:
+            self.logger.error("Failed to reduce images: {}".format(e),
+                              exc_info=True)
+
+    def read_table(self, hdu, columns):
+        """Read only `columns` from table HDU `hdu`.  If any of them is
+        missing from the table, the whole table is read.  The table is
+        returned in native byte order.
+        """
+        colnames = hdu.get_colnames()
+        if not all(name in colnames for name in columns):
+            tbl = hdu.read()
+        else:
+            tbl = hdu.read(columns=columns)
+        # FITS tables are big-endian; swap once here instead of on every
+        # arithmetic operation in plot_stars
+        return tbl.astype(tbl.dtype.newbyteorder('='), copy=False)
+
     def make_WCSes(self):
         self.logger.info('fetching status ...')
         ra, dec, pa = self.sc.fetch_list(['STATS.RA_DEG', 'STATS.DEC_DEG',
@@ -866,8 +960,10 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
                 for idx, hdu in enumerate(fits_f):
                     hdu_name = hdu.get_extname()
                     if hdu_name.startswith('CAM'):
-                        # load camera image
-                        dct[hdu_name] = hdu.read()
+                        # load camera image, kept as contiguous float32 to
+                        # match the frames in quick_data_reduce
+                        dct[hdu_name] = np.ascontiguousarray(hdu.read(),
+                                                             dtype=np.float32)
             self.logger.info("calibration file read successfully")
 
         except Exception as e:
@@ -878,18 +974,11 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
 
     def clear_stars(self, redraw=True):
         # delete previously plotted objects
-        for cam_num in (1, 2, 3, 4, 5, 6):
-            cam_id = 'CAM{}'.format(cam_num)
-            if self.fv.has_channel(cam_id):
-                channel = self.fv.get_channel(cam_id)
-                viewer = channel.viewer
-                canvas = viewer.get_canvas()
-                canvas.delete_objects_by_tag(canvas.get_tags_by_tag_pfx('_go'),
-                                             redraw=redraw)
-                canvas.delete_objects_by_tag(canvas.get_tags_by_tag_pfx('_do'),
-                                             redraw=redraw)
-                canvas.delete_objects_by_tag(canvas.get_tags_by_tag_pfx('_io'),
-                                             redraw=redraw)
+        for channel, viewer, canvas in self._cam_cache.values():
+            tags = (canvas.get_tags_by_tag_pfx('_go') +
+                    canvas.get_tags_by_tag_pfx('_do') +
+                    canvas.get_tags_by_tag_pfx('_io'))
+            canvas.delete_objects_by_tag(tags, redraw=redraw)
 
         # Update PFS_FOV channel
         if self.settings.get('plot_fov', False):
@@ -900,11 +989,18 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
                                              redraw=redraw)
 
     def plot_stars(self):
+        plot_any = (self.settings.get('plot_catalog_stars', False) or
+                    self.settings.get('plot_detected_not_identified', False) or
+                    self.settings.get('plot_identified_stars', False))
         try:
-            self.clear_stars(redraw=False)
+            self.clear_stars(redraw=not plot_any)
         except Exception as e:
             self.logger.error("Error clearing stars: {e}", exc_info=True)
 
+        if not plot_any:
+            # all the overlays are turned off--nothing to build
+            return
+
         plot_fov = self.settings.get('plot_fov', False)
         if plot_fov:
             channel = self.fv.get_channel_on_demand(self.fov_chname)
@@ -915,176 +1011,146 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
 
         if self.tbl_io is None:
             return
-        mags = self.tbl_go['mag']
-
-        do_used = set(self.tbl_io['detected_object_id'])
-        go_used = set(self.tbl_io['guide_object_id'])
-        #go_not_used = set(range(0, len(self.tbl_go))) - go_used
-        go_not_used = set(range(0, len(self.tbl_go)))
-        do_not_used = set(range(0, len(self.tbl_do))) - do_used
 
         radius = 15
 
         if self.settings.get('plot_catalog_stars', False):
             # plot guide objects that are not identified
             color = self.settings.get('guide_color', 'cyan')
-            for go_idx in go_not_used:
-                go_row = self.tbl_go[go_idx]
-                cam_num = go_row['camera_id']
-                #flags = go_row['filter_flags']
-                flags = go_row['filter_flag']
-                if flags & 0x1000:
-                    style = 'cross'
-                elif flags != 0:
-                    style = 'plus'
-                else:
-                    style = 'circle'
-                # pos_x, pos_y = (go_row['guide_object_xdet'],
-                #                 go_row['guide_object_ydet'])
-                pos_x, pos_y = (go_row['x'], go_row['y'])
-                cam_id = 'CAM{}'.format(cam_num + 1)
-                if self.fv.has_channel(cam_id):
-                    p = self.dc.Point(pos_x, pos_y, radius=radius,
-                                      style=style,
+            go_cam_nums = self.tbl_go['camera_id']
+            flags = self.tbl_go['filter_flag']
+            styles = np.where(flags & 0x1000, 'cross',
+                              np.where(flags != 0, 'plus', 'circle'))
+            # pos_x, pos_y = (self.tbl_go['guide_object_xdet'],
+            #                 self.tbl_go['guide_object_ydet'])
+            pos_x, pos_y = self.tbl_go['x'], self.tbl_go['y']
+            for go_idx in range(len(self.tbl_go)):
+                cam = self._cam_cache.get(go_cam_nums[go_idx] + 1)
+                if cam is not None:
+                    p = self.dc.Point(pos_x[go_idx], pos_y[go_idx],
+                                      radius=radius, style=styles[go_idx],
                                       color=color, linewidth=2)
-                    channel = self.fv.get_channel(cam_id)
-                    viewer = channel.fitsimage
-                    canvas = viewer.get_canvas()
-                    canvas.add(p, tag=f'_go{go_idx}', redraw=False)
+                    cam[2].add(p, tag=f'_go{go_idx}', redraw=False)
+
+        # columns of the identified objects table, fetched once
+        matched = self.tbl_io['matched']
+        cam_nums = self.tbl_io['camera_id']
+        ctr_x = self.tbl_io['detected_object_x_pix']
+        ctr_y = self.tbl_io['detected_object_y_pix']
 
         if self.settings.get('plot_detected_not_identified', False):
             # plot detected objects that are not identified
             color = self.settings.get('detected_color', 'yellow')
-            for io_idx, io_row in enumerate(self.tbl_io):
-                if io_row['matched'] > 0:
-                    # <== this is an identified object
-                    continue
-
-                cam_num = io_row['camera_id']
+            for io_idx in np.flatnonzero(matched <= 0):
                 # camera indexes are now 0-based, while HDUs are numbered from 1
-                cam_id = 'CAM{}'.format(cam_num + 1)
-                ctr_x, ctr_y = (io_row['detected_object_x_pix'],
-                                io_row['detected_object_y_pix'])
-                p = self.dc.Point(ctr_x, ctr_y, radius=radius, style='hexagon',
-                                  color=color, linewidth=2)
-
-                if self.fv.has_channel(cam_id):
-                    channel = self.fv.get_channel(cam_id)
-                    viewer = channel.fitsimage
-                    canvas = viewer.get_canvas()
-                    canvas.add(p, tag=f'_do{io_idx}', redraw=False)
-
-        # plot identified objects
-        for io_idx, io_row in enumerate(self.tbl_io):
-            if io_row['matched'] == 0:
-                # skip detected but not identified objects here
-                continue
-
-            cam_num = io_row['camera_id']
-            # camera indexes are now 0-based, while HDUs are numbered from 1
-            cam_id = 'CAM{}'.format(cam_num + 1)
-
-            ctr_x, ctr_y = (io_row['detected_object_x_pix'],
-                            io_row['detected_object_y_pix'])
+                cam = self._cam_cache.get(cam_nums[io_idx] + 1)
+                p = self.dc.Point(ctr_x[io_idx], ctr_y[io_idx], radius=radius,
+                                  style='hexagon', color=color, linewidth=2)
 
-            #_go_row_num = int(io_row['guide_object_id'])
-            #mag = mags[_go_row_num]
+                if cam is not None:
+                    cam[2].add(p, tag=f'_do{io_idx}', redraw=False)
 
-            # skip stars that fall outside the selected area
-            # if not (self.mag_min <= mag <= self.mag_max):
-            #     continue
+        # plot identified objects
+        if self.settings.get('plot_identified_stars', False):
+            # skip detected but not identified objects here
+            io_rows = np.flatnonzero(matched != 0)
+        else:
+            io_rows = np.zeros(0, dtype=int)
+        plot_offsets = self.settings.get('plot_offsets', False)
+        color = self.settings.get('identified_color', 'orangered')
+
+        if plot_offsets and len(io_rows) > 0:
+            #gde_x, gde_y = (self.tbl_io['guide_object_xdet'],
+            #                self.tbl_io['guide_object_ydet'])
+            gde_x = self.tbl_io['guide_object_x_pix']
+            gde_y = self.tbl_io['guide_object_y_pix']
+            # scale the error for better visibility
+            err_long = np.hypot(gde_y - ctr_y, gde_x - ctr_x) * self.error_scale
+            theta_rad = np.arctan2(gde_y - ctr_y, gde_x - ctr_x)
+            long_x = ctr_x + err_long * np.cos(theta_rad)
+            long_y = ctr_y + err_long * np.sin(theta_rad)
+
+        if plot_fov and len(io_rows) > 0:
+            # positions in the FOV viewer, converted a camera at a time
+            fov_ctr_x = np.zeros(len(self.tbl_io))
+            fov_ctr_y = np.zeros(len(self.tbl_io))
+            fov_gde_x = np.zeros(len(self.tbl_io))
+            fov_gde_y = np.zeros(len(self.tbl_io))
+            for cam_num in np.unique(cam_nums[io_rows]):
+                rows = io_rows[cam_nums[io_rows] == cam_num]
+                fov_ctr_x[rows], fov_ctr_y[rows] = self.get_fov_xy(
+                    cam_num, ctr_x[rows], ctr_y[rows])
+                if plot_offsets:
+                    fov_gde_x[rows], fov_gde_y[rows] = self.get_fov_xy(
+                        cam_num, gde_x[rows], gde_y[rows])
+            if plot_offsets:
+                fov_theta_rad = np.arctan2(fov_gde_y - fov_ctr_y,
+                                           fov_gde_x - fov_ctr_x)
+                fov_long_x = fov_ctr_x + err_long * np.cos(fov_theta_rad)
+                fov_long_y = fov_ctr_y + err_long * np.sin(fov_theta_rad)
+
+        # objects are collected per camera and added in one go
+        cam_objs = defaultdict(list)
+        all_fov_objs = []
+        for io_idx in io_rows:
 
             # add circle for detected position
-            #color = self.get_color(mag)
-            color = self.settings.get('identified_color', 'orangered')
-            objs = []
+            c = self.dc.Circle(ctr_x[io_idx], ctr_y[io_idx], radius,
+                               color=color, linewidth=2)
+            p = self.dc.Point(ctr_x[io_idx], ctr_y[io_idx], radius,
+                              style='plus', color=color, linewidth=2)
+            objs = [c, p]
             fov_objs = []
 
-            if self.settings.get('plot_identified_stars', False):
-                c = self.dc.Circle(ctr_x, ctr_y, radius,
-                                   color=color, linewidth=2)
-                p = self.dc.Point(ctr_x, ctr_y, radius, style='plus',
-                                  color=color, linewidth=2)
-                objs.extend([c, p])
-
-                image = self.img_dct[cam_id]
+            if plot_fov:
+                c = self.dc.Circle(fov_ctr_x[io_idx], fov_ctr_y[io_idx],
+                                   radius, color=color, linewidth=2)
+                p = self.dc.Point(fov_ctr_x[io_idx], fov_ctr_y[io_idx],
+                                  radius, style='plus', color=color,
+                                  linewidth=2)
+                fov_objs.extend([c, p])
+
+            if plot_offsets:
+                c = self.dc.Circle(gde_x[io_idx], gde_y[io_idx], radius,
+                                   color=color, linestyle='dash',
+                                   linewidth=2)
+                l = self.dc.Line(ctr_x[io_idx], ctr_y[io_idx],
+                                 long_x[io_idx], long_y[io_idx],
+                                 color=color, linestyle='solid',
+                                 linewidth=2, arrow='end')
+                objs.extend([c, l])
 
                 if plot_fov:
-                    fov_ctr_x, fov_ctr_y = self.get_fov_xy(cam_num, ctr_x, ctr_y)
-                    c = self.dc.Circle(fov_ctr_x, fov_ctr_y, radius,
-                                       color=color, linewidth=2)
-                    p = self.dc.Point(fov_ctr_x, fov_ctr_y, radius, style='plus',
-                                      color=color, linewidth=2)
-                    fov_objs.extend([c, p])
-
-                if self.settings.get('plot_offsets', False):
-
-                    #gde_x, gde_y = (io_row['guide_object_xdet'],
-                    #                io_row['guide_object_ydet'])
-                    gde_x, gde_y = (io_row['guide_object_x_pix'],
-                                    io_row['guide_object_y_pix'])
-                    # go_row = self.tbl_go[_go_row_num]
-                    # gde_x, gde_y = (go_row['guide_object_xdet'],
-                    #                 go_row['guide_object_ydet'])
-
-                    error = np.sqrt((gde_y - ctr_y) ** 2 + (gde_x - ctr_x) ** 2)
-                    # scale the error for better visibility
-                    err_long = error * self.error_scale
-
-                    theta_rad = np.arctan2(gde_y - ctr_y, gde_x - ctr_x)
-                    long_x, long_y = (ctr_x + err_long * np.cos(theta_rad),
-                                      ctr_y + err_long * np.sin(theta_rad))
-
-                    c = self.dc.Circle(gde_x, gde_y, radius,
-                                       color=color, linestyle='dash',
+                    c = self.dc.Circle(fov_gde_x[io_idx], fov_gde_y[io_idx],
+                                       radius, color=color, linestyle='dash',
                                        linewidth=2)
-                    #l = self.dc.Line(ctr_x, ctr_y, gde_x, gde_y,
-                    l = self.dc.Line(ctr_x, ctr_y, long_x, long_y,
+                    l = self.dc.Line(fov_ctr_x[io_idx], fov_ctr_y[io_idx],
+                                     fov_long_x[io_idx], fov_long_y[io_idx],
                                      color=color, linestyle='solid',
                                      linewidth=2, arrow='end')
-                    objs.extend([c, l])
-
-                    if plot_fov:
-                        fov_gde_x, fov_gde_y = self.get_fov_xy(cam_num, gde_x, gde_y)
-
-                        theta_rad = np.arctan2(fov_gde_y - fov_ctr_y, fov_gde_x - fov_ctr_x)
-                        fov_long_x, fov_long_y = (fov_ctr_x + err_long * np.cos(theta_rad),
-                                                  fov_ctr_y + err_long * np.sin(theta_rad))
-
-                        c = self.dc.Circle(fov_gde_x, fov_gde_y, radius,
-                                           color=color, linestyle='dash',
-                                           linewidth=2)
-                        #l = self.dc.Line(fov_ctr_x, fov_ctr_y, fov_gde_x, fov_gde_y,
-                        l = self.dc.Line(fov_ctr_x, fov_ctr_y, fov_long_x, fov_long_y,
-                                         color=color, linestyle='solid',
-                                         linewidth=2, arrow='end')
-                        fov_objs.extend([c, l])
-
-            if len(objs) > 0:
-                if self.fv.has_channel(cam_id):
-                    channel = self.fv.get_channel(cam_id)
-                    viewer = channel.viewer
-                    canvas = viewer.get_canvas()
-
-                    canvas.add(self.dc.CompoundObject(*objs),
-                               tag=f'_io{io_idx}', redraw=False)
-
-            if len(fov_objs) > 0 and plot_fov:
-                if self.fv.has_channel(self.fov_chname):
-                    fov_canvas.add(self.dc.CompoundObject(*fov_objs),
-                                   tag=f'_io{io_idx}', redraw=False)
+                    fov_objs.extend([c, l])
+
+            # camera indexes are now 0-based, while HDUs are numbered from 1
+            cam_objs[cam_nums[io_idx] + 1].extend(objs)
+            all_fov_objs.extend(fov_objs)
+
+        for cam_num, objs in cam_objs.items():
+            cam = self._cam_cache.get(cam_num)
+            if cam is not None:
+                cam[2].add(self.dc.CompoundObject(*objs),
+                           tag=f'_io_all_{cam_num}', redraw=False)
+
+        if len(all_fov_objs) > 0 and plot_fov:
+            if self.fv.has_channel(self.fov_chname):
+                fov_canvas.add(self.dc.CompoundObject(*all_fov_objs),
+                               tag='_io_all', redraw=False)
 
         # update all canvases
         if self.fv.has_channel(self.fov_chname) and plot_fov:
             fov_canvas.update_canvas(whence=3)
 
-        for cam_num in (1, 2, 3, 4, 5, 6):
-            cam_id = 'CAM{}'.format(cam_num)
-            if self.fv.has_channel(cam_id):
-                channel = self.fv.get_channel(cam_id)
-                viewer = channel.viewer
-                canvas = viewer.get_canvas()
-                canvas.update_canvas(whence=3)
+        for channel, viewer, canvas in self._cam_cache.values():
+            canvas.update_canvas(whence=3)
 
     # def get_color(self, mag):
     #     # calculate range of values
@@ -1137,22 +1203,22 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
     def subtract_bias_cb(self, w, tf):
         self.settings.set(subtract_bias=tf)
         if self.current_file is not None:
-            self.fv.nongui_do(self.process_file, self.current_file)
+            self.fv.nongui_do(self._rereduce)
 
     def subtract_bg_cb(self, w, tf):
         self.settings.set(subtract_background=tf)
         if self.current_file is not None:
-            self.fv.nongui_do(self.process_file, self.current_file)
+            self.fv.nongui_do(self._rereduce)
 
     # def subtract_dark_cb(self, w, tf):
     #     self.settings.set(subtract_dark=tf)
     #     if self.current_file is not None:
-    #         self.fv.nongui_do(self.process_file, self.current_file)
+    #         self.fv.nongui_do(self._rereduce)
 
     # def divide_flat_cb(self, w, tf):
     #     self.settings.set(divide_flat=tf)
     #     if self.current_file is not None:
-    #         self.fv.nongui_do(self.process_file, self.current_file)
+    #         self.fv.nongui_do(self._rereduce)
 
     def set_flats_cb(self, w):
         path = w.get_text().strip()
@@ -1192,53 +1258,60 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
 
         data_dir = self.settings.get('data_directory', '.')
         i = inotify.adapters.Inotify()
-        i.add_watch(data_dir)
+        # let the kernel filter out all the events we don't act on
+        i.add_watch(data_dir, mask=(inotify.constants.IN_MOVED_TO |
+                                    inotify.constants.IN_CLOSE_WRITE))
 
         while not ev_quit.is_set():
+            # event_gen waits in epoll on the inotify fd, and drains all
+            # pending events each time it becomes readable
             events = list(i.event_gen(yield_nones=False, timeout_s=1.0))
+            if len(events) == 0:
+                continue
             loop_tot = []
             fits_tot = []
 
             for event in events:
-                if event is not None:
-                    if ('IN_MOVED_TO' in event[1] or
-                        'IN_CLOSE_WRITE' in event[1]):
-                        (header, type_names, watch_path, filename) = event
-                        filepath = os.path.join(watch_path, filename)
-                        filedir, filename = os.path.split(filepath)
-                        loop_tot.append(filename)
-                        # sanity check--this is a FITS file, right?
-                        if not filename.endswith('.fits'):
-                            continue
-
-                        # save filepath for last received one of each type
-                        if filename.startswith('_'):
-                            self.last.setvals(raw=filepath,
-                                              time_raw=time.time())
-                            if self.mode == 'processed':
-                                continue
-                        else:
-                            self.last.setvals(processed=filepath,
-                                              time_processed=time.time())
-                            if self.mode == 'raw':
-                                continue
-
-                        start_time = time.time()
-                        if start_time < self.last.image_time + self.rate_limit:
-                            self.logger.info(f"skipping file '{filename}' for rate limit")
-                            #self.remove_file(filepath)
-                            continue
-
-                        self.last.image_time = start_time
-                        self.logger.debug(f"new file detected: '{filename}'")
-                        if self.pause_flag:
-                            self.logger.debug("plugin is paused, skipping new file")
-                            continue
-
-                        fits_tot.append(filename)
-
-                        self.fv.nongui_do(self.process_file, filepath,
-                                          set_1k=True)
+                (header, type_names, watch_path, filename) = event
+                if watch_events.isdisjoint(type_names):
+                    # e.g. IN_IGNORED or IN_Q_OVERFLOW
+                    continue
+
+                filepath = os.path.join(watch_path, filename)
+                filedir, filename = os.path.split(filepath)
+                loop_tot.append(filename)
+                # sanity check--this is a FITS file, right?
+                if not filename.endswith('.fits'):
+                    continue
+
+                # save filepath for last received one of each type
+                if filename.startswith('_'):
+                    self.last.setvals(raw=filepath,
+                                      time_raw=time.time())
+                    if self.mode == 'processed':
+                        continue
+                else:
+                    self.last.setvals(processed=filepath,
+                                      time_processed=time.time())
+                    if self.mode == 'raw':
+                        continue
+
+                start_time = time.time()
+                if start_time < self.last.image_time + self.rate_limit:
+                    self.logger.info(f"skipping file '{filename}' for rate limit")
+                    #self.remove_file(filepath)
+                    continue
+
+                self.last.image_time = start_time
+                self.logger.debug(f"new file detected: '{filename}'")
+                if self.pause_flag:
+                    self.logger.debug("plugin is paused, skipping new file")
+                    continue
+
+                fits_tot.append(filename)
+
+                self.fv.nongui_do(self.process_file, filepath,
+                                  set_1k=True)
 
             self.logger.debug("---------")
             self.logger.debug("{} files: {}".format(len(loop_tot), loop_tot))
@@ -1281,18 +1354,14 @@ class PFS_AG(GingaPlugin.GlobalPlugin):
 
     def auto_orient(self):
         auto_orient = self.settings.get('auto_orient', False)
-        for cam_num in (1, 2, 3, 4, 5, 6):
-            cam_id = 'CAM{}'.format(cam_num)
-            if self.fv.has_channel(cam_id):
-                channel = self.fv.get_channel(cam_id)
-                viewer = channel.viewer
-                with viewer.suppress_redraw:
-                    viewer.transform(False, False, False)
-                    viewer.rotate(0.0)
-                    if auto_orient:
-                        rot_ang_deg = self.rot_angles[cam_num - 1]
-                        viewer.rotate(rot_ang_deg)
-                        viewer.transform(False, True, False)
+        for cam_num, (channel, viewer, canvas) in self._cam_cache.items():
+            with viewer.suppress_redraw:
+                viewer.transform(False, False, False)
+                viewer.rotate(0.0)
+                if auto_orient:
+                    rot_ang_deg = self.rot_angles[cam_num - 1]
+                    viewer.rotate(rot_ang_deg)
+                    viewer.transform(False, True, False)
 
     def auto_orient_cb(self, w, tf):
         self.settings.set(auto_orient=tf)
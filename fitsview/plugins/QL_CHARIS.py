@@ -61,7 +61,6 @@ class QL_CHARIS(GingaPlugin.GlobalPlugin):
         settings = zi.get_settings()
         zi.set_bg(0.4, 0.4, 0.4)
         zi.set_color_map('gray')
-        zi.set_color_map('gray')
         zi.set_intensity_map('ramp')
         # for debugging
         zi.set_name('charis_qimage')
@@ -127,7 +127,8 @@ class QL_FOCAS(ObsLog.ObsLog):
 
         if not self.gui_up:
             return
-        self.reduce_ql(exp_id, ch1_fits, ch2_fits)
+        # bias subtraction reads both frames--keep it off the GUI thread
+        self.fv.nongui_do(self.reduce_ql, exp_id, ch1_fits, ch2_fits)
 
     def add_to_obslog(self, header, image):
         # if int(header.get('DET-ID', '')) != 1:
@@ -151,6 +152,8 @@ class QL_FOCAS(ObsLog.ObsLog):
         self.gui_up = False
 
     def reduce_ql(self, imname, ch1_fits, ch2_fits):
+        self.fv.assert_nongui_thread()
+
         # create a new image
         new_img = AstroImage(logger=self.logger)
         if self.cache_dir is None:
@@ -170,7 +173,8 @@ class QL_FOCAS(ObsLog.ObsLog):
             new_img.load_hdu(hdulist[0])
 
         except Exception as e:
-            self.fv.show_error("Bias subtraction failed: %s" % (str(e)))
+            self.fv.gui_do(self.fv.show_error,
+                           "Bias subtraction failed: %s" % (str(e)))
             return
 
         if impath is not None and not impath.exists():
@@ -32,7 +32,7 @@ Double-click on a log entry.
 
 """
 import threading
-
+from collections import OrderedDict
 
 from naoj.hsc import hsc_dr
 from g2base.astro.frame import Frame
@@ -54,7 +54,9 @@ class QL_HSC(ObsLog.ObsLog):
         self.dr = hsc_dr.HyperSuprimeCamDR(logger=self.logger)
         self.fov_deg = 2.0
         self.lock = threading.RLock()
-        self.processed_frames = set([])
+        # recently processed exposures, oldest first
+        self.processed_frames = OrderedDict()
+        self.max_processed = 4096
         self.sort_hdr = 'Exp_ID'
         self.sort_kwd = 'EXP-ID'
 
@@ -126,7 +128,9 @@ class QL_HSC(ObsLog.ObsLog):
             # have we processed this image before
             if exp_num in self.processed_frames:
                 return
-            self.processed_frames.add(exp_num)
+            self.processed_frames[exp_num] = None
+            while len(self.processed_frames) > self.max_processed:
+                self.processed_frames.popitem(last=False)
 
         self.logger.info(f"incoming exposure {exp_num}")
         header = image.get_header()
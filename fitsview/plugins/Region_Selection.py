@@ -36,6 +36,18 @@ class Region_Selection(GingaPlugin.LocalPlugin):
 
         self.obj_qs = None
         self.objtag = None
+        # counts the quality calculations started by redo(), and the
+        # last of them whose result has been shown
+        self.redo_count = 0
+        self.done_count = 0
+        # redo() restarts this timer, so that only the last of a quick
+        # series of regions is calculated
+        self.redo_args = None
+        self.redo_timer = self.fv.get_timer()
+        self.redo_timer.add_callback('expired', self.redo_timer_cb)
+        self.redo_delay = 0.05
+        # (image, equinox, cdelt) of the last image measured
+        self.wcs_info = None
         self.objcolor = 'green'
 
         self.dx = 30
@@ -231,6 +243,9 @@ class Region_Selection(GingaPlugin.LocalPlugin):
     def stop(self):
         self.logger.debug("disabling canvas")
         self.canvas.ui_set_active(False)
+        self.redo_timer.clear()
+        self.redo_args = None
+        self.wcs_info = None
         self.gui_up = False
 
     def close(self):
@@ -247,6 +262,10 @@ class Region_Selection(GingaPlugin.LocalPlugin):
 
     def ok(self):
         self.logger.info("OK clicked.")
+        if self.done_count != self.redo_count:
+            # the result for the current region is not in yet
+            self.fv.show_status("Still calculating, please press OK again")
+            return True
         p = self.callerInfo.get_data()
 
         try:
@@ -352,38 +371,74 @@ class Region_Selection(GingaPlugin.LocalPlugin):
             return True
         bbox  = obj.objects[0]
         point = obj.objects[1]
-        data_x, data_y = point.x, point.y
         # make sure corners are LL, UR
         x1, y1, x2, y2 = bbox.get_llur()
 
-        p = self.callerInfo.get_data()
-        try:
-            image = self.fitsimage.get_image()
-
-            # sanity check on region
-            width = x2 - x1
-            height = y2 - y1
-            dx = width // 2
-            dy = height // 2
-            if (width > self.max_len) or (height > self.max_len):
-                errmsg = "Image area (%dx%d) too large!" % (
-                    width, height)
-                self.fv.show_status(errmsg)
-                raise Exception(errmsg)
-
-            # Note: FITS coordinates are 1-based, whereas numpy FITS arrays
-            # are 0-based
-            fits_x, fits_y = data_x + 1, data_y + 1
-
-            self.wdetail.sample_area.set_text('%dx%d' % (width, height))
-
-            if self.use_new_algorithm:
-                qualsize = self.iqcalc.qualsize
-            else:
-                qualsize = self.iqcalc.qualsize_old
+        image = self.fitsimage.get_image()
 
+        # sanity check on region
+        width = x2 - x1
+        height = y2 - y1
+        if (width > self.max_len) or (height > self.max_len):
+            errmsg = "Image area (%dx%d) too large!" % (
+                width, height)
+            self.fv.show_status(errmsg)
+            self.logger.error("Error calculating quality metrics: %s" % (
+                errmsg))
+            # drops any calculation still pending for an earlier region
+            self.redo_count += 1
+            self.done_count = self.redo_count
+            self.qualsize_failed(image, point, x1, y1, x2, y2)
+            return True
+
+        self.wdetail.sample_area.set_text('%dx%d' % (width, height))
+
+        if self.use_new_algorithm:
+            qualsize = self.iqcalc.qualsize
+        else:
+            qualsize = self.iqcalc.qualsize_old
+
+        # the calculation is done off the GUI thread, after a short delay
+        # that is restarted by each new region; results for a region that
+        # has been replaced in the meantime are dropped
+        self.redo_count += 1
+        self.redo_args = (self.redo_count, qualsize, image, point,
+                          x1, y1, x2, y2)
+        self.redo_timer.set(self.redo_delay)
+        return True
+
+    def redo_timer_cb(self, timer):
+        args, self.redo_args = self.redo_args, None
+        if args is not None:
+            self.fv.nongui_do(self.calc_qualsize, *args)
+
+    def calc_qualsize(self, count, qualsize, image, point, x1, y1, x2, y2):
+        try:
             qs = qualsize(image, x1, y1, x2, y2,
                           radius=self.radius, threshold=self.threshold)
+
+        except Exception as e:
+            self.logger.error("Error calculating quality metrics: %s" % (
+                str(e)))
+            qs = None
+
+        self.fv.gui_do(self.show_qualsize, count, qs, image, point,
+                       x1, y1, x2, y2)
+
+    def show_qualsize(self, count, qs, image, point, x1, y1, x2, y2):
+        if count != self.redo_count or not self.gui_up:
+            # superseded by a newer region, or the plugin was closed
+            return
+        self.done_count = count
+
+        if qs is None:
+            self.qualsize_failed(image, point, x1, y1, x2, y2)
+            return
+
+        p = self.callerInfo.get_data()
+        try:
+            dx = (x2 - x1) // 2
+            dy = (y2 - y1) // 2
             p.x, p.y = qs.x, qs.y
 
             # Calculate X/Y of center of star
@@ -417,14 +472,12 @@ class Region_Selection(GingaPlugin.LocalPlugin):
             try:
                 # Calc RA, DEC, EQUINOX of X/Y center pixel
                 ra_txt, dec_txt = image.pixtoradec(obj_x, obj_y, format='str')
-                equinox = image.get_keyword('EQUINOX', 'UNKNOWN')
+                equinox, cdelt = self.get_wcs_info(image)
                 self.wdetail.equinox.set_text(str(equinox))
 
                 # TODO: Get separate FWHM for X and Y
                 #cdelt1, cdelt2 = image.get_keywords_list('CDELT1', 'CDELT2')
                 #starsize = self.iqcalc.starsize(fwhm, cdelt1, fwhm, cdelt2)
-                header = image.get_header()
-                rot, cdelt = wcs.get_xy_rotation_and_scale(header)
                 starsize = self.iqcalc.starsize(fwhm, cdelt[0], fwhm, cdelt[1])
                 self.wdetail.star_size.set_text('%.3f' % starsize)
 
@@ -438,23 +491,42 @@ class Region_Selection(GingaPlugin.LocalPlugin):
             self.wdetail.dec.set_text(dec_txt)
 
         except Exception as e:
-            point.color = 'red'
             self.logger.error("Error calculating quality metrics: %s" % (
                 str(e)))
-            self.wdetail.star_size.set_text('Failed')
-            self.obj_qs = None
+            self.qualsize_failed(image, point, x1, y1, x2, y2)
+            return
 
-            # set region
-            p.x1, p.y1 = max(0, x1), max(0, y1)
-            width = image.width
-            height = image.height
-            p.x2 = min(width - 1,  x2)
-            p.y2 = min(height - 1, y2)
+        self.canvas.redraw(whence=3)
+
+        self.fv.show_status("Click left mouse button to reposition pick")
+
+    def get_wcs_info(self, image):
+        """Returns the equinox and the pixel scale of `image`.  These are
+        only looked up from the header once per image.
+        """
+        if self.wcs_info is None or self.wcs_info[0] is not image:
+            equinox = image.get_keyword('EQUINOX', 'UNKNOWN')
+            header = image.get_header()
+            rot, cdelt = wcs.get_xy_rotation_and_scale(header)
+            self.wcs_info = (image, equinox, cdelt)
+        return self.wcs_info[1:]
+
+    def qualsize_failed(self, image, point, x1, y1, x2, y2):
+        p = self.callerInfo.get_data()
+        point.color = 'red'
+        self.wdetail.star_size.set_text('Failed')
+        self.obj_qs = None
+
+        # set region
+        p.x1, p.y1 = max(0, x1), max(0, y1)
+        width = image.width
+        height = image.height
+        p.x2 = min(width - 1,  x2)
+        p.y2 = min(height - 1, y2)
 
         self.canvas.redraw(whence=3)
 
         self.fv.show_status("Click left mouse button to reposition pick")
-        return True
 
     def update(self, canvas, event, data_x, data_y):
         try:
@@ -20,7 +20,9 @@ NOTE: this requires the "naojutils" module, available at
           https://github.com/naojsoft/naojutils
 """
 import os, re, glob
+import copy
 import queue as Queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ginga import AstroImage
 from ginga.rv.plugins import Mosaic
@@ -33,6 +35,9 @@ from g2base.astro.frame import Frame
 #   Get it here--> https://github.com/naojsoft/naojutils
 from naoj.spcam import spcam_dr
 
+# flat field tiles are named '<anything>-<ccd id>.fits'
+flat_regex = re.compile(r'-(\d+)\.fits$')
+
 
 class SPCAM(Mosaic.Mosaic):
 
@@ -186,7 +191,7 @@ class SPCAM(Mosaic.Mosaic):
             exp_num = self.get_exp_num(frame)
 
             # add paths to exposure->paths map
-            exp_id = Frame(path=path)
+            exp_id = copy.copy(frame)
             exp_id.number = exp_num
             exp_frid = str(exp_id)
             bnch = Bunch.Bunch(paths=set([]), name=exp_frid)
@@ -267,14 +272,12 @@ class SPCAM(Mosaic.Mosaic):
         self.fv.assert_gui_thread()
         self.logger.info("processing queued frames")
 
-        # Get all files stored in the queue
-        paths = []
-        while True:
-            try:
-                path = self.queue.get(block=False)
-                paths.append(path)
-            except Queue.Empty:
-                break
+        # Get all files stored in the queue, under a single lock
+        # (the queue is unbounded and nobody join()s it, so there are
+        # no waiters to notify)
+        with self.queue.mutex:
+            paths = list(self.queue.queue)
+            self.queue.queue.clear()
 
         self.logger.debug("1. paths=%s" % str(paths))
         if len(paths) == 0:
@@ -352,7 +355,6 @@ class SPCAM(Mosaic.Mosaic):
         return newimage
 
     def _load_flats(self, datadir):
-        # TODO: parallelize this
         self.fv.assert_nongui_thread()
 
         path_glob = os.path.join(datadir, '*-*.fits')
@@ -366,33 +368,38 @@ class SPCAM(Mosaic.Mosaic):
         self.update_status("Loading flats...")
         self.init_progress()
 
-        self.total_files = max(1, len(paths))
-        self.ingest_count = 0
-
+        # one task per file; the FITS reads release the GIL
         num_threads = self.settings.get('num_threads', 4)
-        groups = self.split_n(paths, num_threads)
-        for group in groups:
-            self.fv.nongui_do(self._load_some, d, group)
-
-    def _load_some(self, d, paths):
-        for path in paths:
-            match = re.match(r'^.+\-(\d+)\.fits$', path)
-            if match:
-                ccd_id = int(match.group(1))
-                image = AstroImage.AstroImage(logger=self.logger)
-                image.load_file(path)
-
-                with self.lock:
-                    d[ccd_id] = image.get_data()
-                    self.ingest_count += 1
-                    count = self.ingest_count
-
-                self.update_progress(float(count)/self.total_files)
-
-        if count == self.total_files:
-            self.flat = d
-            self.end_progress()
-            self.update_status("Flats loaded.")
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = [executor.submit(self._load_flat, path)
+                       for path in paths]
+            for count, future in enumerate(as_completed(futures), 1):
+                try:
+                    ccd_id, data = future.result()
+                    if ccd_id is not None:
+                        d[ccd_id] = data
+
+                except Exception as e:
+                    self.logger.error("Error loading flat: %s" % (str(e)))
+
+                self.update_progress(float(count) / len(paths))
+
+        self.flat = d
+        self.end_progress()
+        self.update_status("Flats loaded.")
+
+    def _load_flat(self, path):
+        """Load one flat field tile.  Returns the CCD id and the data, or
+        (None, None) if `path` is not named like a flat.
+        """
+        match = flat_regex.search(path)
+        if not match:
+            return (None, None)
+
+        ccd_id = int(match.group(1))
+        image = AstroImage.AstroImage(logger=self.logger)
+        image.load_file(path)
+        return (ccd_id, image.get_data())
 
     def load_flats_cb(self, w):
         dirpath = self.w.flat_dir.get_text().strip()
@@ -70,7 +70,7 @@ class MESLocate:
         self.drag_index = [-1]     # index of the current drag for each object
         self.drag_start = None     # the place for beginning to drag
         # the new obj_arr based on user input and calculations
-        self.obj_centroids = np.zeros(self.obj_arr.shape)
+        self.obj_centroids = np.empty(self.obj_arr.shape)
         self.square_size = {'star': 30, 'mask': 60, 'starhole': 20}[
             mode]  # the apothem of the search regions
         self.exp_obj_size = {'star': 4, 'mask': 20, 'starhole': 4}[
@@ -80,18 +80,9 @@ class MESLocate:
 
         # set some values based on mode
         self.mode = mode
-        if mode == 'star':
-            autocut_method = 'stddev'   # fitsimage autocut method
-            # the maximum expected radius of objects
-            self.exp_obj_size = 4
-            self.square_size = 30       # the apothem of the search regions
-        elif mode == 'mask':
-            autocut_method = 'minmax'
-            self.exp_obj_size = 20
-            self.square_size = 60
-        elif mode == 'starhole':
-            autocut_method = 'minmax'
-            self.exp_obj_size = 4
+        autocut_method = {'star': 'stddev', 'mask': 'minmax',
+                          'starhole': 'minmax'}[mode]  # fitsimage autocut
+        if mode == 'starhole':
             # Use np.nanmax to ignore any objects with radius set to
             # NaN (those are objects that were skipped over in the
             # mask image step)
@@ -192,17 +192,18 @@ class SuprimeCamDR:
                    ValueError("median array len (%d) doesn't match effective pixel len (%d)" % (
                 len_ovsc, efht))
 
+            # a column, broadcast along the rows when subtracting
             ovsc_median = ovsc_median.reshape((efht, 1))
-            ovsc_median = numpy.repeat(ovsc_median, efwd, axis=1)
 
             j = ch.startposx
 
-            # Cut effective pixel region into output array
+            # Cut effective pixel region into output array, subtracting
+            # the overscan medians on the way
             xlo, xhi, ylo, yhi = j, j + efwd, 0, efht
-            out[ylo:yhi, xlo:xhi] = data_np[ch.efminy:ch.efmaxy+1,
-                                            ch.efminx:ch.efmaxx+1] - ovsc_median
-            # Subtract overscan medians
-            #out[ylo:yhi, xlo:xhi] -= ovsc_median
+            out_ch = out[ylo:yhi, xlo:xhi]
+            numpy.subtract(data_np[ch.efminy:ch.efmaxy+1,
+                                   ch.efminx:ch.efmaxx+1],
+                           ovsc_median, out=out_ch)
 
             # Update header for effective regions
             if header is not None: